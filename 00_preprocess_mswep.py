@@ -1,78 +1,163 @@
 #!/usr/bin/env python
-"""Select area for precipitation from MSWEP."""
+"""Select area for precipitation from MSWEP.
+
+In watch mode, the NRT directory is polled every ``POLL_INTERVAL`` seconds
+and new or replaced files are processed with at most ``MAX_WORKERS`` CDO
+processes at a time. After each poll with newly processed files, the shell
+command ``REFRESH_HOOK`` is run (if set), for example to concatenate the
+files and rerun the downstream stages.
+
+The NRT directory is only listed again if its modification time changed,
+which is the case if files are added, or replaced by renaming them (as done
+by rsync). The listed files are then compared with the manifest by size and
+modification time, and only new or replaced files are processed.
+
+Files that could not be processed are retried after ``RETRY_DELAY`` seconds,
+doubling the delay after each failure up to ``MAX_RETRY_DELAY``, or as soon
+as they change.
+"""
 
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from pathlib import Path
 
 from tqdm import tqdm
 
+import manifest
+
 CDO_COMMAND = [
     "cdo",
     "-L",
+    "-O",
     "-sellonlatbox,-118.6,-117.4,33.4,34.6",
     "-selname,precipitation",
 ]
 
 MSWEP_DIR = Path("/data0/data/mswep_v280")
 
-LOG_DIR = Path("log")
 OUTPUT_DIR = Path("/data0/tmp/la_fires/precip")
 
+POLL_INTERVAL = 60  # seconds
+MAX_WORKERS = 4
+REFRESH_HOOK = None  # e.g. "./cli.py concatenate precip"
 
-def main():
-    LOG_DIR.mkdir(exist_ok=True)
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Files modified more recently may still be being written
+SETTLE_TIME = 30  # seconds
+
+RETRY_DELAY = 5 * 60  # seconds
+MAX_RETRY_DELAY = 24 * 60 * 60  # seconds
+
+
+def process(f, output_file):
+    # Each worker uses its own connection to the manifest
+    with closing(manifest.connect()) as conn:
+        return manifest.run(conn, f, output_file, CDO_COMMAND)
 
+
+def watch(interval=POLL_INTERVAL, max_workers=MAX_WORKERS, hook=REFRESH_HOOK):
+    """Process new NRT files as they arrive, until interrupted."""
+    dataset = "mswep_nrt"
     nrt_dir = MSWEP_DIR / "NRT" / "3hourly"
-    past_dir = MSWEP_DIR / "Past" / "3hourly"
 
-    files = {
-        "skipped": [],
-        "past": [],
-        "nrt": [],
-        "error": [],
+    # Modification time, number of failures and time of the next retry of
+    # the files that failed
+    failed = {}
+
+    print(f"Watching {nrt_dir} (Ctrl-C to stop)")
+
+    conn = manifest.connect()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while True:
+                manifest.scan(conn, dataset, nrt_dir, OUTPUT_DIR)
+
+                now = time.time()
+
+                files = []
+                for f, output_file in manifest.pending(conn, dataset):
+                    try:
+                        mtime = f.stat().st_mtime
+                    except FileNotFoundError:
+                        continue
+                    if now - mtime < SETTLE_TIME:
+                        continue
+                    if f in failed:
+                        failed_mtime, _, retry_time = failed[f]
+                        if mtime == failed_mtime and now < retry_time:
+                            continue
+                    files.append((f, output_file, mtime))
+
+                futures = [
+                    executor.submit(process, f, output_file)
+                    for f, output_file, _ in files
+                ]
+                processed = 0
+                for (f, _, mtime), future in zip(files, futures, strict=True):
+                    if future.result():
+                        processed += 1
+                        failed.pop(f, None)
+                        continue
+
+                    _, failures, _ = failed.get(f, (None, 0, None))
+                    delay = min(RETRY_DELAY * 2**failures, MAX_RETRY_DELAY)
+                    failed[f] = (mtime, failures + 1, time.time() + delay)
+                    print(f"-> Could not process {f}, retry in {delay} s")
+
+                if processed:
+                    print(f"{time.ctime()}: processed {processed} files")
+                    if hook:
+                        result = subprocess.run(hook, shell=True)
+                        if result.returncode != 0:
+                            print(f"-> Refresh hook failed: {hook}")
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopped.")
+        finally:
+            conn.close()
+
+
+def main(
+    rescan=False,
+    watch_nrt=False,
+    interval=POLL_INTERVAL,
+    max_workers=MAX_WORKERS,
+    hook=REFRESH_HOOK,
+):
+    if watch_nrt:
+        OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+        watch(interval=interval, max_workers=max_workers, hook=hook)
+        return
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    source_dirs = {
+        "mswep_past": MSWEP_DIR / "Past" / "3hourly",
+        "mswep_nrt": MSWEP_DIR / "NRT" / "3hourly",
     }
 
-    # Past
-    for f in tqdm(sorted(past_dir.glob("*.nc"))):
-        output_file = OUTPUT_DIR / f.name
-        if output_file.exists():
-            files["skipped"].append(f)
-            continue
-
-        command = CDO_COMMAND + [f, output_file]
-        result = subprocess.run(command, stdout=subprocess.DEVNULL)
-
-        if result.returncode != 0:
-            files["error"].append(f)
-        else:
-            files["past"].append(f)
-
-    # NRT
-    for f in tqdm(sorted(nrt_dir.glob("*.nc"))):
-        output_file = OUTPUT_DIR / f.name
-        if output_file.exists():
-            files["skipped"].append(f)
-            continue
-
-        command = CDO_COMMAND + [f, output_file]
-        result = subprocess.run(command, stdout=subprocess.DEVNULL)
-
-        if result.returncode != 0:
-            files["error"].append(f)
-        else:
-            files["nrt"].append(f)
-
-    # Save logs
-    for logtype, filepaths in files.items():
-        with open(LOG_DIR / f"precip_{logtype}.log", "w") as logfile:
-            for f in filepaths:
-                logfile.write(f"{f}\n")
-
-    if files["error"]:
+    conn = manifest.connect()
+
+    for dataset, source_dir in source_dirs.items():
+        manifest.scan(conn, dataset, source_dir, OUTPUT_DIR, rescan=rescan)
+
+        for f, output_file in tqdm(manifest.pending(conn, dataset)):
+            manifest.run(conn, f, output_file, CDO_COMMAND)
+
+    errors = [
+        error
+        for dataset in source_dirs
+        for error in manifest.errors(conn, dataset)
+    ]
+    if errors:
         print("Could not properly process the following files:")
-        for f in files["error"]:
+        for f, _ in errors:
             print(f)
+        print(f"Errors are saved in {manifest.MANIFEST_FILE}")
+
+    conn.close()
 
     print("Done.")
 
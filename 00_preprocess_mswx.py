@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 """Select area for temperature from MSWX."""
 
-import subprocess
 import sys
 from pathlib import Path
 
 from tqdm import tqdm
 
+import manifest
+
 CDO_COMMAND = [
     "cdo",
     "-L",
+    "-O",
     "-sellonlatbox,-118.6,-117.4,33.4,34.6",
 ]
 
@@ -21,48 +23,30 @@ VARIABLES = {
     "wind": "Wind",
 }
 
-LOG_DIR = Path("log")
 OUTPUT_DIR = Path("/data0/tmp/la_fires")
 
 
-def main(variable="temp"):
-    log_dir = LOG_DIR / variable
+def main(variable="temp", rescan=False):
     output_dir = OUTPUT_DIR / variable
-    log_dir.mkdir(exist_ok=True)
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    dataset = f"mswx_{variable}"
     past_dir = MSWX_DIR / "Past" / VARIABLES[variable] / "3hourly"
 
-    files = {
-        "skipped": [],
-        "past": [],
-        "error": [],
-    }
-
-    for f in tqdm(sorted(past_dir.glob("*.nc"))):
-        output_file = output_dir / f.name
-        if output_file.exists():
-            files["skipped"].append(f)
-            continue
-
-        command = CDO_COMMAND + [f, output_file]
-        result = subprocess.run(command, stdout=subprocess.DEVNULL)
-
-        if result.returncode != 0:
-            files["error"].append(f)
-        else:
-            files["past"].append(f)
-
-    # Save logs
-    for logtype, filepaths in files.items():
-        with open(LOG_DIR / f"temp_{logtype}.log", "w") as logfile:
-            for f in filepaths:
-                logfile.write(f"{f}\n")
-
-    if files["error"]:
+    conn = manifest.connect()
+    manifest.scan(conn, dataset, past_dir, output_dir, rescan=rescan)
+
+    for f, output_file in tqdm(manifest.pending(conn, dataset)):
+        manifest.run(conn, f, output_file, CDO_COMMAND)
+
+    errors = manifest.errors(conn, dataset)
+    if errors:
         print("Could not properly process the following files:")
-        for f in files["error"]:
+        for f, _ in errors:
             print(f)
+        print(f"Errors are saved in {manifest.MANIFEST_FILE}")
+
+    conn.close()
 
     print("Done.")
 
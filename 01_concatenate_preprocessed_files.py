@@ -1,21 +1,51 @@
 #!/usr/bin/env python
-"""Concatenate NetCDF files from preprocessed MSWX or MSWEP."""
+"""Index or concatenate NetCDF files from preprocessed MSWX or MSWEP.
+
+By default, the time coverage of each preprocessed file is saved to the index
+``data/<variable>.index.json``, and ``02_select_data.py`` reads the files
+overlapping the selected dates directly (see ``ncutils.build_index``). Only
+new or changed files are opened. With ``cat``, the files are concatenated to
+``data/<variable>.nc`` with CDO instead.
+"""
 
 import subprocess
 import sys
 from pathlib import Path
 
+import ncutils
+
 CDO_COMMAND = ["cdo", "cat"]
 
 INPUT_DIR = Path("/data0/tmp/la_fires")
 OUTPUT_DIR = Path("data")
 
 
-def main(variable):
+def main(variable, cat=False):
     OUTPUT_DIR.mkdir(exist_ok=True)
 
     output_file = OUTPUT_DIR / f"{variable}.nc"
+    index_file = ncutils.index_path(variable, OUTPUT_DIR)
+
+    if not cat:
+        print(f"Indexing {variable}...")
+        entries = ncutils.build_index(
+            variable, INPUT_DIR / variable, OUTPUT_DIR
+        )
+        print(f"{len(entries)} files")
+
+        # The index replaces the concatenated file
+        if output_file.exists():
+            print(f"Removing {output_file}")
+            output_file.unlink()
+            ncutils.clear_time_cache(output_file)
+
+        print("Done.")
+        return
+
+    index_file.unlink(missing_ok=True)
+    ncutils.index_time_path(variable, OUTPUT_DIR).unlink(missing_ok=True)
     output_file.unlink(missing_ok=True)
+    ncutils.clear_time_cache(output_file)
     print(f"Concatenating {variable}...")
     command = CDO_COMMAND + [f"{INPUT_DIR}/{variable}/*.nc", output_file]
     subprocess.run(command)
@@ -27,6 +57,6 @@ if __name__ == "__main__":
     try:
         variable = sys.argv[1]
     except IndexError:
-        print(f"Usage: {sys.argv[0]} VARIABLE")
+        print(f"Usage: {sys.argv[0]} VARIABLE [--cat]")
     else:
-        main(variable)
+        main(variable, cat="--cat" in sys.argv[2:])
@@ -11,25 +11,21 @@ This script:
 from datetime import datetime
 from pathlib import Path
 
-import cartopy.crs as ccrs
-import matplotlib.pyplot as plt
-import netCDF4 as nc
 import numpy as np
 
+import diagnostics
+import ncutils
+import store
 import utils
+from config import LAT_LA, LON_LA
 
 START = datetime(1979, 1, 1)
 END = datetime(2025, 3, 1)
 
 VARIABLES = ["temp", "precip", "rh", "swd", "wind"]
 
-NETCDF_NAMES = {
-    "temp": "air_temperature",
-    "precip": "precipitation",
-    "rh": "relative_humidity",
-    "swd": "downward_shortwave_radiation",
-    "wind": "wind_speed",
-}
+# Saved with only the wet time steps, see ``store.save``
+SPARSE_VARIABLES = ["precip"]
 
 OUTPUT_DIR = Path("output/select_data")
 FIG_DIR = Path("fig")
@@ -37,133 +33,153 @@ FIG_DIR = Path("fig")
 DEBUG = True
 PLOT = False
 
-LAT_LA = 34.05
-LON_LA = -118.25
-
 
 def remove_leap_days(value, time):
     leap_days = np.array([d.month == 2 and d.day == 29 for d in time])
     return value[~leap_days]
 
 
-# %% Load data
-
-variables = {}
-dates = {}
-
-lats: np.ndarray = None  # type: ignore
-lons: np.ndarray = None  # type: ignore
-
-for i, varname in enumerate(VARIABLES):
-    with nc.Dataset(f"data/{varname}.nc") as ncfile:
-        ncfile.set_auto_mask(False)
+def plot_domain(temp, lats, lons):
+    # Imported here to keep startup fast when not plotting
+    import cartopy.crs as ccrs
+    import matplotlib.pyplot as plt
 
-        nc_variable = NETCDF_NAMES[varname]
-        variables[varname] = ncfile.variables[nc_variable][:]
+    temp = utils.mask_ocean_values(temp)
 
-        time = ncfile.variables["time"]
-        dates[varname] = nc.num2date(
-            time[:], time.units, only_use_cftime_datetimes=False
-        )
+    fig = plt.figure(figsize=(5, 4))
+    ax = plt.axes(projection=ccrs.PlateCarree())
+    ax.coastlines()
+    ax.plot(LON_LA, LAT_LA, "k*", label="LA")
+    cs = ax.pcolormesh(lons, lats, temp[0], cmap="inferno")
+    ax.legend()
+    gl = ax.gridlines(
+        draw_labels=True,
+        dms=True,
+        x_inline=False,
+        y_inline=False,
+        color="none",
+    )
+    gl.top_labels = False
+    gl.right_labels = False
 
-        if i == 0:
-            lats = ncfile.variables["lat"][:]
-            lons = ncfile.variables["lon"][:]
+    cbar = fig.colorbar(cs)
+    cbar.set_label("Temperature (°C)")
 
+    fig.tight_layout()
 
-# %% Fill in missing precipitation time steps
+    FIG_DIR.mkdir(exist_ok=True, parents=True)
+    fig.savefig(FIG_DIR / "domain.png")
 
-# MSWEP includes some time steps where all precipitation values are invalid.
-# Replace the precipitation values at these time steps with the linearly
-# interpolated value between the previous and next time steps.
-precip = variables["precip"]
-invalid_precip = np.all(precip > 1e9, axis=(-1, -2))
+    plt.show()
 
-for timestep in np.argwhere(invalid_precip):
-    t = timestep.item()
-    date = dates["precip"][t]
-    print(f"-> Missing precipitation: {date}")
-    if t == 0 or t == precip.shape[0] - 1:
-        raise NotImplementedError
-    precip[t] = 0.5 * (precip[t - 1] + precip[t + 1])
 
+def run(variables, dates, start=START, end=END):
+    """Select data from ``variables`` read with ``ncutils.load_variables``.
 
-# %% Select time steps
+    Returns the selected values and time axes as named in the store.
 
-options = dict(start=START, end=END, include_endpoint=True)
+    """
+    # %% Fill in missing precipitation time steps
 
-for varname, values in variables.items():
-    time = dates[varname]
-    variables[varname] = utils.select_time(values, time, **options)
-    dates[varname] = utils.select_time(time, time, **options)
+    # MSWEP includes some time steps where all precipitation values are
+    # invalid. Replace the precipitation values at these time steps with the
+    # linearly interpolated value between the previous and next time steps.
+    precip = variables["precip"]
+    invalid_precip = np.all(precip > 1e9, axis=(-1, -2))
 
+    for timestep in np.argwhere(invalid_precip):
+        t = timestep.item()
+        date = dates["precip"][t]
+        print(f"-> Missing precipitation: {date}")
+        if t == 0 or t == precip.shape[0] - 1:
+            raise NotImplementedError
+        precip[t] = 0.5 * (precip[t - 1] + precip[t + 1])
 
-# %% Remove leap days
+    # %% Select time steps and remove leap days
 
-for varname, values in variables.items():
-    time = dates[varname]
-    variables[varname] = remove_leap_days(values, time)
-    dates[varname] = remove_leap_days(time, time)
+    options = dict(start=start, end=end, include_endpoint=True)
 
+    outputs = {}
+    for varname, values in variables.items():
+        time = dates[varname]
+        assume_sorted = utils.is_sorted(time)
+        values = utils.select_time(
+            values, time, assume_sorted=assume_sorted, **options
+        )
+        time = utils.select_time(
+            time, time, assume_sorted=assume_sorted, **options
+        )
+        outputs[varname] = remove_leap_days(values, time)
+        outputs[f"time_{varname}"] = remove_leap_days(time, time)
+
+    return outputs
+
+
+def save(outputs, lats, lons, start=START, end=END):
+    """Save ``outputs`` of ``run`` and return the precipitation diagnostics."""
+    sources = {
+        varname: store.fingerprint(ncutils.source_path(varname))
+        for varname in VARIABLES
+    }
+    store.set_attrs(OUTPUT_DIR, start=start, end=end, sources=sources)
+    store.save(OUTPUT_DIR, "lats", lats)
+    store.save(OUTPUT_DIR, "lons", lons)
+    for name, values in outputs.items():
+        if not name.startswith("time_"):
+            time = outputs[f"time_{name}"]
+            store.save(
+                OUTPUT_DIR,
+                name,
+                values,
+                time=time,
+                sparse=name in SPARSE_VARIABLES,
+            )
+
+    return diagnostics.update(
+        OUTPUT_DIR,
+        "precip",
+        outputs["precip"],
+        outputs["time_precip"],
+        lats,
+        lons,
+    )
 
-# %% Save
 
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-np.save(OUTPUT_DIR / "lats", lats)
-np.save(OUTPUT_DIR / "lons", lons)
-for varname, values in variables.items():
-    time = dates[varname]
-    np.save(OUTPUT_DIR / f"{varname}", values)
-    np.save(OUTPUT_DIR / f"time_{varname}", time)
+def main(start=START, end=END, debug=DEBUG, plot=PLOT):
+    # %% Load data
 
+    # Files are independent, so read and decode them in parallel
+    # Only files overlapping the selection are read for indexed variables
+    variables, dates, lats, lons = ncutils.load_variables(
+        VARIABLES, start=start, end=end
+    )
 
-# %% Check precipitaiton in LA
+    # %% Select data
 
-if DEBUG:
-    months = np.arange(1, 12 + 1)
-    days_in_months = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    outputs = run(variables, dates, start=start, end=end)
 
-    j = np.argmin(np.abs(lats - LAT_LA))
-    i = np.argmin(np.abs(lons - LON_LA))
+    # %% Save
 
-    precip_LA = variables["precip"][:, j, i]
-    precip_months = np.array([d.month for d in dates["precip"]])
+    diagnostics_precip = save(outputs, lats, lons, start=start, end=end)
 
-    print(":: Average precipitation in LA (mm)")
-    for m, days in zip(months, days_in_months, strict=True):
-        sel = precip_months == m
-        avg_precip = precip_LA[sel].mean() * 8 * days
-        print(f"Month {m}: {avg_precip:.2f}")
+    # %% Check precipitaiton in LA
 
-# %% Plot
+    if debug:
+        months = np.arange(1, 12 + 1)
+        days_in_months = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
-if PLOT:
-    temp = utils.apply_mask(variables["temp"])
-    precip = utils.apply_mask(variables["precip"])
+        precip_LA = diagnostics_precip["monthly_point"]
 
-    fig = plt.figure(figsize=(5, 4))
-    ax = plt.axes(projection=ccrs.PlateCarree())
-    ax.coastlines()
-    ax.plot(LON_LA, LAT_LA, "k*", label="LA")
-    cs = ax.pcolormesh(lons, lats, temp[0], cmap="inferno")
-    # ax.pcolormesh(lons, lats, precip[20])
-    ax.legend()
-    gl = ax.gridlines(
-        draw_labels=True,
-        dms=True,
-        x_inline=False,
-        y_inline=False,
-        color="none",
-    )
-    gl.top_labels = False
-    gl.right_labels = False
+        print(":: Average precipitation in LA (mm)")
+        for m, days in zip(months, days_in_months, strict=True):
+            avg_precip = precip_LA[m - 1] * 8 * days
+            print(f"Month {m}: {avg_precip:.2f}")
 
-    cbar = fig.colorbar(cs)
-    cbar.set_label("Temperature (°C)")
+    # %% Plot
 
-    fig.tight_layout()
+    if plot:
+        plot_domain(outputs["temp"], lats, lons)
 
-    FIG_DIR.mkdir(exist_ok=True, parents=True)
-    fig.savefig(FIG_DIR / "domain.png")
 
-    plt.show()
+if __name__ == "__main__":
+    main()
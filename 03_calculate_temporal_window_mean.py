@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 """Calculate temporal mean over averaging windows.
 
-The output is a 2D array with dimensions (year, window).
+The output is a 2D array with dimensions (year, window). If
+``PER_CELL_SEASONS`` is set, the mean for each grid cell is also saved as a
+4D array with dimensions (year, window, lat, lon).
+
+If ``LAND_ONLY`` is set, only land cells are kept, so that the mean for each
+grid cell has dimensions (year, window, n_land). The land mask is saved as
+``land_mask``.
 """
 
 from datetime import datetime, timedelta
@@ -9,8 +15,9 @@ from pathlib import Path
 
 import numpy as np
 
+import store
 import utils
-from config import AVERAGE_WINDOW_DAYS
+from config import AVERAGE_WINDOW_DAYS, LAND_ONLY, PER_CELL_SEASONS
 
 INPUT_DIR = Path("output/select_data")
 OUTPUT_DIR = Path("output/calculate_temporal_window_mean")
@@ -39,14 +46,23 @@ def create_averaging_bounds(window_size):
     return bounds
 
 
-def temporal_mean(time, array, bounds, debug=False):
+def temporal_mean(time, array, bounds, debug=False, per_cell=False):
     """Temporally average ``array`` over each year using averaging windows
-    specified by ``bounds``."""
-    years = np.unique([d.year for d in time])
+    specified by ``bounds``.
+
+    If ``per_cell`` is True, the mean of each grid cell is also returned
+    (otherwise None), using the same selection of each window.
+
+    """
+    time = np.asarray(time).astype("datetime64[s]")
+    years = np.unique(time.astype("datetime64[Y]").astype(int) + 1970)
     nyears = years.size
     shape = (nyears, len(bounds))
 
     temporal_mean = np.zeros(shape)
+    temporal_mean_cells = None
+    if per_cell:
+        temporal_mean_cells = np.zeros(shape + array.shape[1:])
     window_start = np.zeros(shape, dtype="datetime64[s]")
     window_mid = np.zeros(shape, dtype="datetime64[s]")
     window_end = np.zeros(shape, dtype="datetime64[s]")
@@ -64,11 +80,18 @@ def temporal_mean(time, array, bounds, debug=False):
             else:
                 end = b_end.replace(year=year)
 
-            sel = (time >= start) & (time < end)
+            sel = (time >= np.datetime64(start)) & (time < np.datetime64(end))
             if sel.sum() > 0:
-                temporal_mean[iyear, iwindow] = np.nanmean(array[sel])
+                selected = array[sel]
+                temporal_mean[iyear, iwindow] = np.nanmean(selected)
+                if per_cell:
+                    temporal_mean_cells[iyear, iwindow] = np.nanmean(
+                        selected, axis=0
+                    )
             else:
                 temporal_mean[iyear, iwindow] = np.nan
+                if per_cell:
+                    temporal_mean_cells[iyear, iwindow] = np.nan
 
             if debug:
                 # NOTE: Hard-coded for 3-hourly data
@@ -84,42 +107,95 @@ def temporal_mean(time, array, bounds, debug=False):
         if debug and deviations:
             print(f"{deviations}")
 
-    return temporal_mean, window_start, window_mid, window_end
+    return (
+        temporal_mean,
+        temporal_mean_cells,
+        window_start,
+        window_mid,
+        window_end,
+    )
+
+
+def run(
+    precip,
+    time,
+    debug=DEBUG,
+    per_cell=PER_CELL_SEASONS,
+    land_only=LAND_ONLY,
+):
+    """Average ``precip`` over averaging windows.
+
+    Returns the results as named in the store.
+
+    """
+    years = np.array([d.year for d in time])
+
+    if land_only:
+        land_mask = utils.land_mask()
+        precip = utils.pack_land(precip, land_mask)
+    else:
+        precip = utils.mask_ocean_values(precip)
+
+    # %% Create average bounds
+
+    window_size = timedelta(days=AVERAGE_WINDOW_DAYS)
+    bounds = create_averaging_bounds(window_size)
+
+    # %% Average over averaging windows
+
+    if debug:
+        print(":: Precipitation")
 
+    results = temporal_mean(
+        time, precip, bounds, debug=debug, per_cell=per_cell
+    )
+    precip_temporal_mean, precip_cells = results[:2]
+    window_start, window_mid, window_end = results[2:]
 
-# %% Load data
+    outputs = {
+        "precip": precip_temporal_mean,
+        "years": np.unique(years),
+        "window_start": window_start,
+        "window_mid": window_mid,
+        "window_end": window_end,
+    }
 
-precip = np.load(INPUT_DIR / "precip.npy")
-time = np.load(INPUT_DIR / "time_precip.npy", allow_pickle=True)
-years = np.array([d.year for d in time])
+    if per_cell:
+        outputs["precip_cells"] = precip_cells
 
-precip = utils.mask_ocean_values(precip)
+    if land_only:
+        outputs["land_mask"] = land_mask
 
+    return outputs
 
-# %% Spatial average
 
-precip_spatial_mean = np.nanmean(precip, axis=(-1, -2))
+def save(outputs):
+    store.set_attrs(
+        OUTPUT_DIR,
+        average_window_days=AVERAGE_WINDOW_DAYS,
+        land_only="land_mask" in outputs,
+        sources={"select_data": store.fingerprint(INPUT_DIR)},
+    )
+    for name, values in outputs.items():
+        store.save(OUTPUT_DIR, name, values)
 
 
-# %% Create average bounds
+def main(debug=DEBUG, per_cell=PER_CELL_SEASONS, land_only=LAND_ONLY):
+    # %% Load data
 
-window_size = timedelta(days=AVERAGE_WINDOW_DAYS)
-bounds = create_averaging_bounds(window_size)
+    precip = store.load(INPUT_DIR, "precip")
+    time = store.load(INPUT_DIR, "time_precip")
 
+    # %% Average
 
-# %% Average over averaging windows
+    outputs = run(
+        precip, time, debug=debug, per_cell=per_cell, land_only=land_only
+    )
 
-if DEBUG:
-    print(":: Precipitation")
+    # %% Save
 
-results = temporal_mean(time, precip, bounds, debug=DEBUG)
-precip_temporal_mean, window_start, window_mid, window_end = results
+    save(outputs)
 
-# %% Save
 
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-np.save(OUTPUT_DIR / "precip", precip_temporal_mean)
-np.save(OUTPUT_DIR / "years", np.unique(years))
-np.save(OUTPUT_DIR / "window_start", window_start)
-np.save(OUTPUT_DIR / "window_mid", window_mid)
-np.save(OUTPUT_DIR / "window_end", window_end)
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,41 @@
 #!/usr/bin/env python
-"""Identify dry and wet seasons from climatological median precipitation."""
+"""Identify dry and wet seasons from climatological median precipitation.
+
+If ``PER_CELL_SEASONS`` is set, dry seasons are also identified for each grid
+cell and each threshold in ``PRECIP_THRESHOLDS``.
+"""
 
 from datetime import timedelta
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 
-from config import AVERAGE_WINDOW_DAYS
+import seasons
+import store
+from config import AVERAGE_WINDOW_DAYS, PER_CELL_SEASONS
 
 INPUT_DIR = Path("output/calculate_temporal_window_mean")
 OUTPUT_DIR = Path("output/identify_dry_wet_seasons")
 FIG_DIR = Path("fig")
 
 PRECIP_THRESHOLD = 0.02  # mm/3hr
+PRECIP_THRESHOLDS = [0.01, 0.02, 0.05]  # mm/3hr, only used per grid cell
 
 PLOT = False
 
 
-# %% Load data
-
-precip = np.load(INPUT_DIR / "precip.npy")
-window_mid = np.load(INPUT_DIR / "window_mid.npy", allow_pickle=True)
-
-
-# %% Find wet and dry seasons
-
-# Exclude first and last years (incomplete data)
-precip = precip[1:-1]
-window_mid = window_mid[1:-1]
-
-median_precip = np.nanmedian(precip, axis=0)
-dry_season = np.argwhere(median_precip < PRECIP_THRESHOLD)
-
-t_start = dry_season[0].item()
-t_end = dry_season[-1].item()
-
-half_average_window = timedelta(days=AVERAGE_WINDOW_DAYS // 2)
-dry_start = window_mid[0][t_start] - half_average_window
-dry_end = window_mid[0][t_end] + half_average_window
-
-print(f"Dry season start: {dry_start}")
-print(f"Dry season end: {dry_end}")
-
-
-# %% Save
-
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-np.save(OUTPUT_DIR / "dry_start", dry_start)
-np.save(OUTPUT_DIR / "dry_end", dry_end)
+def plot_seasons(median_precip, window_mid, dry_start, dry_end, threshold):
+    # Imported here to keep startup fast when not plotting
+    import matplotlib.pyplot as plt
+    import seaborn as sns
 
+    # Day in year
+    days = seasons.time_of_year(window_mid) / seasons.SECONDS_PER_DAY + 1
+    dry_start, dry_end = (
+        seasons.time_of_year([dry_start, dry_end]) / seasons.SECONDS_PER_DAY
+        + 1
+    )
 
-# %% Plot
-
-if PLOT:
     sns.set_style("whitegrid")
     sns.set_color_codes()
 
@@ -63,8 +44,8 @@ if PLOT:
     fig = plt.figure(figsize=(16, 8))
     ax = fig.add_subplot(111)
 
-    ax.plot(days, precip, "o-", color="k")
-    ax.axhline(THRESHOLD, linestyle="--", color="r")
+    ax.plot(days, median_precip, "o-", color="k")
+    ax.axhline(threshold, linestyle="--", color="r")
 
     ymin, ymax = plt.ylim()
     xmin, xmax = 1, 365
@@ -98,3 +79,112 @@ if PLOT:
     fig.savefig(FIG_DIR / "wet_dry_seasons.png")
 
     plt.show()
+
+
+def run(
+    precip,
+    window_mid,
+    precip_cells=None,
+    threshold=PRECIP_THRESHOLD,
+    per_cell=PER_CELL_SEASONS,
+):
+    """Identify dry season from window means of 03.
+
+    Returns the results as named in the store and the median precipitation.
+
+    """
+    # %% Find wet and dry seasons
+
+    # Exclude first and last years (incomplete data)
+    precip = precip[1:-1]
+    window_mid = window_mid[1:-1]
+
+    median_precip = np.nanmedian(precip, axis=0)
+    dry_season = np.argwhere(median_precip < threshold)
+
+    t_start = dry_season[0].item()
+    t_end = dry_season[-1].item()
+
+    half_average_window = timedelta(days=AVERAGE_WINDOW_DAYS // 2)
+    dry_start = window_mid[0][t_start] - half_average_window
+    dry_end = window_mid[0][t_end] + half_average_window
+
+    print(f"Dry season start: {dry_start}")
+    print(f"Dry season end: {dry_end}")
+
+    outputs = {"dry_start": dry_start, "dry_end": dry_end}
+
+    # %% Find wet and dry seasons for each grid cell
+
+    if per_cell:
+        thresholds = np.unique([threshold] + PRECIP_THRESHOLDS)
+
+        dry_start_index, dry_end_index = seasons.identify_dry_season_cells(
+            precip_cells[1:-1], thresholds
+        )
+        half_window = np.timedelta64(half_average_window)
+
+        outputs["thresholds"] = thresholds
+        outputs["dry_start_index"] = dry_start_index
+        outputs["dry_end_index"] = dry_end_index
+        outputs["dry_start_cells"] = seasons.index_to_offset(
+            dry_start_index, window_mid[0] - half_window
+        )
+        outputs["dry_end_cells"] = seasons.index_to_offset(
+            dry_end_index, window_mid[0] + half_window
+        )
+
+        for value, index in zip(thresholds, dry_start_index, strict=True):
+            fraction = np.mean(index >= 0)
+            print(f"Threshold {value}: dry season in {fraction:.0%} of cells")
+
+    return outputs, median_precip
+
+
+def save(outputs, threshold=PRECIP_THRESHOLD):
+    store.set_attrs(
+        OUTPUT_DIR,
+        precip_threshold=threshold,
+        sources={
+            "calculate_temporal_window_mean": store.fingerprint(INPUT_DIR)
+        },
+    )
+    for name, values in outputs.items():
+        store.save(OUTPUT_DIR, name, values)
+
+
+def main(threshold=PRECIP_THRESHOLD, per_cell=PER_CELL_SEASONS, plot=PLOT):
+    # %% Load data
+
+    precip = store.load(INPUT_DIR, "precip")
+    window_mid = store.load(INPUT_DIR, "window_mid")
+    precip_cells = store.load(INPUT_DIR, "precip_cells") if per_cell else None
+
+    # %% Find wet and dry seasons
+
+    outputs, median_precip = run(
+        precip,
+        window_mid,
+        precip_cells,
+        threshold=threshold,
+        per_cell=per_cell,
+    )
+
+    # %% Save
+
+    save(outputs, threshold=threshold)
+
+    # %% Plot
+
+    if plot:
+        plot_seasons(
+            median_precip,
+            window_mid[1],
+            outputs["dry_start"],
+            outputs["dry_end"],
+            threshold,
+        )
+
+
+if __name__ == "__main__":
+    main()
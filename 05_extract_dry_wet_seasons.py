@@ -2,74 +2,214 @@
 """Extract dry and wet seasons from data.
 
 The year corresponds to the year when the season starts (also for wet season).
+
+The seasons are accumulated one year at a time in a single pass over the
+data, so that only the climatology (mean for each time step of the season) and
+the mean seasonal total are kept in memory and saved.
+
+If precipitation is saved sparse, only its wet time steps are read and added,
+but the climatology itself is dense (one season of time steps).
+
+If ``PER_CELL_SEASONS`` is set, the mean seasonal total is also calculated
+with the dry and wet seasons of each grid cell.
+
+If ``LAND_ONLY`` is set, only land cells are kept, so that all results have
+the land cells (n_land) instead of (lat, lon) as grid cell dimensions.
 """
 
+from datetime import datetime
 from pathlib import Path
 
 import numpy as np
 
+import seasons
+import store
+import utils
+from config import LAND_ONLY, PER_CELL_SEASONS
+
 INPUT_DIR = Path("output/select_data")
 INPUT_DIR_DRY_SEASON = Path("output/identify_dry_wet_seasons")
 
 OUTPUT_DIR = Path("output/extract_dry_wet_seasons")
 
 
-def extract_season(data, time, years, dry_start, dry_end, wet_or_dry):
-    data_season = []
-    time_season = []
-
-    for year in years:
-        if wet_or_dry == "dry":
-            start = dry_start.replace(year=year)
-            end = dry_end.replace(year=year)
-        else:
-            start = dry_end.replace(year=year)
-            end = dry_start.replace(year=year + 1)
-
-        sel = (start <= time) & (time < end)
-        data_season.append(data[sel])
-        time_season.append(time[sel])
-
-    data_season = np.array(data_season)
-    time_season = np.array(time_season)
-
-    return time_season, data_season
-
+def iter_years(data, time, years, assume_sorted=False):
+    """Yield time and data from the start of each of ``years`` for two years.
 
-# %% Load data
+    This covers the dry and wet seasons starting in the year. The selections
+    are views of ``time`` and ``data``.
 
-precip = np.load(INPUT_DIR / "precip.npy")
-time = np.load(INPUT_DIR / "time_precip.npy", allow_pickle=True)
-years = np.unique([d.year for d in time])
-
-dry_start = np.load(
-    INPUT_DIR_DRY_SEASON / "dry_start.npy", allow_pickle=True
-).item()
-dry_end = np.load(
-    INPUT_DIR_DRY_SEASON / "dry_end.npy", allow_pickle=True
-).item()
-
-
-# %% Analysis
-
-# Skip last two years (incomplete wet season)
-years = years[:-2]
-
-# In the code we treat the year as when a season (dry or wet) starts.
-# This makes it easier to deal with.
-
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-time_dry, precip_dry = extract_season(
-    precip, time, years, dry_start, dry_end, "dry"
-)
-
-time_wet, precip_wet = extract_season(
-    precip, time, years, dry_start, dry_end, "wet"
-)
-
-np.save(OUTPUT_DIR / "years", years)
-np.save(OUTPUT_DIR / f"precip_dry", precip_dry)
-np.save(OUTPUT_DIR / f"time_dry", time_dry)
-np.save(OUTPUT_DIR / f"precip_wet", precip_wet)
-np.save(OUTPUT_DIR / f"time_wet", time_wet)
+    """
+    for year in years:
+        options = dict(
+            start=datetime(year, 1, 1),
+            end=datetime(year + 2, 1, 1),
+            assume_sorted=assume_sorted,
+        )
+        yield (
+            year,
+            utils.select_time(time, time, **options),
+            utils.select_time(data, time, **options),
+        )
+
+
+def season_bounds(year, dry_start, dry_end, wet_or_dry):
+    """Start and end of the season starting in ``year``."""
+    if wet_or_dry == "dry":
+        return dry_start.replace(year=year), dry_end.replace(year=year)
+    return dry_end.replace(year=year), dry_start.replace(year=year + 1)
+
+
+def select_threshold(cells, thresholds, threshold):
+    """Select the per-cell boundary maps of ``threshold``."""
+    ithreshold = np.flatnonzero(np.isclose(thresholds, threshold))[0]
+    return cells[ithreshold]
+
+
+def run(
+    precip,
+    time,
+    dry_start,
+    dry_end,
+    dry_start_cells=None,
+    dry_end_cells=None,
+    land_only=LAND_ONLY,
+):
+    """Accumulate the dry and wet seasons of ``precip``.
+
+    If the per-cell boundary maps (lat, lon) are given, the seasons are also
+    accumulated for each grid cell. ``precip`` can be an array or a
+    :class:`sparse.SparseSeries`. Returns the results as named in the store.
+
+    """
+    years = np.unique([d.year for d in time])
+
+    if land_only:
+        precip = utils.pack_land(precip, utils.land_mask())
+
+    # %% Analysis
+
+    # Skip last two years (incomplete wet season)
+    years = years[:-2]
+
+    # In the code we treat the year as when a season (dry or wet) starts.
+    # This makes it easier to deal with.
+
+    outputs = {"years": years}
+
+    accumulators = {
+        "dry": seasons.SeasonAccumulator(),
+        "wet": seasons.SeasonAccumulator(),
+    }
+
+    # Seasons with the boundaries of each grid cell
+    accumulators_cells = {}
+    if dry_start_cells is not None:
+        accumulators_cells = {
+            "dry": seasons.SeasonAccumulator(climatology=False),
+            "wet": seasons.SeasonAccumulator(climatology=False),
+        }
+
+    # The selections of each year are sorted if the whole time axis is
+    assume_sorted = utils.is_sorted(time)
+
+    for year, time_year, precip_year in iter_years(
+        precip, time, years, assume_sorted
+    ):
+        for wet_or_dry, accumulator in accumulators.items():
+            start, end = season_bounds(year, dry_start, dry_end, wet_or_dry)
+            options = dict(start=start, end=end, assume_sorted=assume_sorted)
+            accumulator.add(
+                utils.select_time(precip_year, time_year, **options)
+            )
+
+            # Time axis of the first year, other years are shifted by full
+            # years
+            if f"time_{wet_or_dry}" not in outputs:
+                outputs[f"time_{wet_or_dry}"] = utils.select_time(
+                    time_year, time_year, **options
+                )
+
+        for wet_or_dry, accumulator in accumulators_cells.items():
+            mask = seasons.season_mask(
+                time_year, year, dry_start_cells, dry_end_cells, wet_or_dry
+            )
+            accumulator.add(precip_year, mask)
+
+    for wet_or_dry, accumulator in accumulators.items():
+        outputs[f"precip_{wet_or_dry}_clim"] = accumulator.mean()
+        outputs[f"precip_{wet_or_dry}_total"] = accumulator.total()
+
+    if accumulators_cells:
+        outputs["dry_start_cells"] = dry_start_cells
+        outputs["dry_end_cells"] = dry_end_cells
+        for wet_or_dry, accumulator in accumulators_cells.items():
+            outputs[f"precip_{wet_or_dry}_total_cells"] = accumulator.total()
+
+    return outputs
+
+
+def save(outputs, land_only=LAND_ONLY):
+    store.set_attrs(
+        OUTPUT_DIR,
+        land_only=land_only,
+        sources={
+            "select_data": store.fingerprint(INPUT_DIR),
+            "identify_dry_wet_seasons": store.fingerprint(
+                INPUT_DIR_DRY_SEASON
+            ),
+        },
+    )
+    for name, values in outputs.items():
+        store.save(OUTPUT_DIR, name, values)
+
+
+def main(per_cell=PER_CELL_SEASONS, land_only=LAND_ONLY):
+    # %% Load data
+
+    # Only the wet time steps are read if precipitation is saved sparse
+    if store.is_sparse(INPUT_DIR, "precip"):
+        precip = store.load_sparse(INPUT_DIR, "precip")
+    else:
+        precip = store.load(INPUT_DIR, "precip")
+    time = store.load(INPUT_DIR, "time_precip")
+
+    dry_start = store.load(INPUT_DIR_DRY_SEASON, "dry_start").item()
+    dry_end = store.load(INPUT_DIR_DRY_SEASON, "dry_end").item()
+
+    dry_start_cells = None
+    dry_end_cells = None
+    if per_cell:
+        threshold = store.get_attrs(INPUT_DIR_DRY_SEASON)["precip_threshold"]
+        thresholds = store.load(INPUT_DIR_DRY_SEASON, "thresholds")
+
+        dry_start_cells = select_threshold(
+            store.load(INPUT_DIR_DRY_SEASON, "dry_start_cells"),
+            thresholds,
+            threshold,
+        )
+        dry_end_cells = select_threshold(
+            store.load(INPUT_DIR_DRY_SEASON, "dry_end_cells"),
+            thresholds,
+            threshold,
+        )
+
+    # %% Extract seasons
+
+    outputs = run(
+        precip,
+        time,
+        dry_start,
+        dry_end,
+        dry_start_cells,
+        dry_end_cells,
+        land_only=land_only,
+    )
+
+    # %% Save
+
+    save(outputs, land_only=land_only)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
-"""Scale precipitation to climatological seasonal total."""
+"""Scale precipitation to climatological seasonal total.
 
+If ``PER_CELL_SEASONS`` is set, each grid cell is scaled over its own wet
+season.
+
+Only the time window around the wet season of ``TARGET_YEAR`` is read and
+scaled. The output store refers to the input store for all other time steps.
+
+If ``LAND_ONLY`` is set, only land cells are scaled, with the results of
+05 for land cells.
+"""
+
+from datetime import datetime
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 
+import diagnostics
+import seasons
+import store
+import utils
+from config import LAND_ONLY, PER_CELL_SEASONS
+
 INPUT_DIR = Path("output/select_data")
 INPUT_DIR_SEASONS = Path("output/extract_dry_wet_seasons/")
 
@@ -16,54 +32,18 @@ TARGET_YEAR = 2023
 PLOT = False
 
 
-# %% Load data
-
-years = np.load(INPUT_DIR_SEASONS / "years.npy")
-precip_dry = np.load(INPUT_DIR_SEASONS / "precip_dry.npy")
-precip_wet = np.load(INPUT_DIR_SEASONS / "precip_wet.npy")
-time_dry = np.load(INPUT_DIR_SEASONS / "time_dry.npy", allow_pickle=True)
-time_wet = np.load(INPUT_DIR_SEASONS / "time_wet.npy", allow_pickle=True)
-
-precip = np.load(INPUT_DIR / "precip.npy")
-time = np.load(INPUT_DIR / "time_precip.npy", allow_pickle=True)
-
-wet_start = time_wet[0, 0]
-wet_end = time_wet[0, -1]
-
-
-# %% Get climatology
-
-precip_dry_clim = precip_dry.mean(axis=0)
-precip_wet_clim = precip_wet.mean(axis=0)
-
-
-# %% Scale
-
-wet_start_target = wet_start.replace(year=TARGET_YEAR)
-wet_end_target = wet_end.replace(year=TARGET_YEAR + 1)
-sel = (wet_start_target <= time) & (time <= wet_end_target)
+def plot_scaling(
+    scaling_factor,
+    time_target,
+    precip_target,
+    precip_target_scaled,
+    precip_wet_clim,
+    wet_start_target,
+    wet_end_target,
+):
+    # Imported here to keep startup fast when not plotting
+    import matplotlib.pyplot as plt
 
-precip_target = precip[sel]
-time_target = time[sel]
-
-precip_target_sum = precip_target.sum(axis=0)
-
-scaling_factor = precip_wet_clim.sum(axis=0) / precip_target_sum
-
-precip_scaled = precip.copy()
-precip_scaled[sel] = scaling_factor * precip[sel]
-
-
-# %% Save
-
-OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
-np.save(OUTPUT_DIR / "precip", precip_scaled)
-np.save(OUTPUT_DIR / "time_precip", time)
-
-
-# %% Plot
-
-if PLOT:
     FIG_DIR.mkdir(exist_ok=True, parents=True)
 
     fig = plt.figure(figsize=(8, 6))
@@ -83,13 +63,31 @@ if PLOT:
     fig = plt.figure(figsize=(8, 6))
     ax = fig.add_subplot(111)
 
-    csum_precip = np.cumsum(precip[sel].mean(axis=(-1, -2)))
-    csum_precip_scaled = np.cumsum(precip_scaled[sel].mean(axis=(-1, -2)))
-    csum_precip_clim = np.cumsum(precip_wet_clim.mean(axis=(-1, -2)))
-
-    ax.plot(time_target, csum_precip_clim, "k-", lw=2, label="Climatology")
-    ax.plot(time_target, csum_precip, label="Original")
-    ax.plot(time_target, csum_precip_scaled, label="Scaled")
+    # Domain wet season (the window is longer for PER_CELL_SEASONS)
+    options = dict(
+        start=wet_start_target,
+        end=wet_end_target,
+        include_endpoint=True,
+        assume_sorted=utils.is_sorted(time_target),
+    )
+    time_wet_target = utils.select_time(time_target, time_target, **options)
+    precip_wet_target = utils.select_time(
+        precip_target, time_target, **options
+    )
+    precip_wet_target_scaled = utils.select_time(
+        precip_target_scaled, time_target, **options
+    )
+
+    # Ocean cells of the climatology are NaN for LAND_ONLY
+    csum_precip = np.cumsum(precip_wet_target.mean(axis=(-1, -2)))
+    csum_precip_scaled = np.cumsum(
+        precip_wet_target_scaled.mean(axis=(-1, -2))
+    )
+    csum_precip_clim = np.cumsum(np.nanmean(precip_wet_clim, axis=(-1, -2)))
+
+    ax.plot(time_wet_target, csum_precip_clim, "k-", lw=2, label="Climatology")
+    ax.plot(time_wet_target, csum_precip, label="Original")
+    ax.plot(time_wet_target, csum_precip_scaled, label="Scaled")
 
     ax.set_xlabel("Month")
     ax.set_ylabel("Cumulative sum of 3-hourly precipitation (mm/3hr)")
@@ -99,3 +97,184 @@ if PLOT:
     fig.savefig(FIG_DIR / "cumulative_sum.png")
 
     plt.show()
+
+
+def target_window(time_wet, target_year, per_cell=PER_CELL_SEASONS):
+    """Time window that is scaled and the wet season of ``target_year``."""
+    wet_start_target = time_wet[0].replace(year=target_year)
+    wet_end_target = time_wet[-1].replace(year=target_year + 1)
+
+    if per_cell:
+        # Wet seasons of all grid cells are within these two years
+        window = dict(
+            start=datetime(target_year, 1, 1),
+            end=datetime(target_year + 2, 1, 1),
+        )
+    else:
+        window = dict(
+            start=wet_start_target, end=wet_end_target, include_endpoint=True
+        )
+
+    return window, wet_start_target, wet_end_target
+
+
+def target_start_index(time, time_target, target_year):
+    """Index of the first time step of ``time_target`` in ``time``."""
+    if len(time_target) == 0:
+        raise ValueError(f"No data in the time window of {target_year}")
+    return np.searchsorted(time, time_target[0])
+
+
+def run(
+    precip_target,
+    time_target,
+    precip_wet_total,
+    target_year=TARGET_YEAR,
+    precip_wet_total_cells=None,
+    dry_start_cells=None,
+    dry_end_cells=None,
+    land_only=LAND_ONLY,
+):
+    """Scale ``precip_target`` in the window returned by ``target_window``.
+
+    If the per-cell totals and boundary maps are given, each grid cell is
+    scaled over its own wet season. Returns the scaled precipitation and the
+    scaling factor.
+
+    If ``land_only`` is True, the results of 05 are for land cells only, and
+    ocean cells are not scaled (the scaling factor is NaN).
+
+    """
+    if land_only:
+        land_mask = utils.land_mask()
+        precip_full = precip_target
+        precip_target = utils.pack_land(precip_target, land_mask)
+
+    if precip_wet_total_cells is not None:
+        mask = seasons.season_mask(
+            time_target, target_year, dry_start_cells, dry_end_cells, "wet"
+        )
+        precip_target_sum = np.where(mask, precip_target, 0).sum(axis=0)
+
+        # Cells without a wet season have an empty mask and are not scaled
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scaling_factor = precip_wet_total_cells / precip_target_sum
+
+        precip_target_scaled = np.where(
+            mask, scaling_factor * precip_target, precip_target
+        )
+    else:
+        precip_target_sum = precip_target.sum(axis=0)
+        scaling_factor = precip_wet_total / precip_target_sum
+        precip_target_scaled = scaling_factor * precip_target
+
+    precip_target_scaled = precip_target_scaled.astype(precip_target.dtype)
+
+    if land_only:
+        precip_target_scaled = utils.unpack_land(
+            precip_target_scaled, land_mask, precip_full
+        )
+        scaling_factor = utils.unpack_land(scaling_factor, land_mask)
+
+    return precip_target_scaled, scaling_factor
+
+
+def save(precip_target_scaled, target_start, target_year=TARGET_YEAR):
+    """Save the scaled window starting at index ``target_start``."""
+    # The output refers to the input except for the chunks in the scaled window
+    store.set_attrs(
+        OUTPUT_DIR,
+        target_year=target_year,
+        sources={
+            "select_data": store.fingerprint(INPUT_DIR),
+            "extract_dry_wet_seasons": store.fingerprint(INPUT_DIR_SEASONS),
+        },
+    )
+    store.link(INPUT_DIR, OUTPUT_DIR, "precip")
+    store.write_window(
+        OUTPUT_DIR, "precip", precip_target_scaled, target_start
+    )
+
+    diagnostics.update_window(
+        OUTPUT_DIR,
+        "precip",
+        diagnostics.load(INPUT_DIR, "precip"),
+        precip_target_scaled,
+        target_start,
+        store.load(INPUT_DIR, "lats"),
+        store.load(INPUT_DIR, "lons"),
+    )
+
+
+def main(
+    target_year=TARGET_YEAR,
+    per_cell=PER_CELL_SEASONS,
+    land_only=LAND_ONLY,
+    plot=PLOT,
+):
+    # %% Load data
+
+    precip_wet_clim = store.load(INPUT_DIR_SEASONS, "precip_wet_clim")
+    precip_wet_total = store.load(INPUT_DIR_SEASONS, "precip_wet_total")
+    time_wet = store.load(INPUT_DIR_SEASONS, "time_wet")
+
+    time = store.load(INPUT_DIR, "time_precip")
+
+    window, wet_start_target, wet_end_target = target_window(
+        time_wet, target_year, per_cell
+    )
+
+    # Only the time window that is scaled is read
+    precip_target = store.load(INPUT_DIR, "precip", **window)
+    time_target = utils.select_time(
+        time,
+        time,
+        assume_sorted=store.is_sorted(INPUT_DIR, "time_precip"),
+        **window,
+    )
+    target_start = target_start_index(time, time_target, target_year)
+
+    cells = {}
+    if per_cell:
+        for name in [
+            "precip_wet_total_cells",
+            "dry_start_cells",
+            "dry_end_cells",
+        ]:
+            cells[name] = store.load(INPUT_DIR_SEASONS, name)
+
+    # %% Scale
+
+    precip_target_scaled, scaling_factor = run(
+        precip_target,
+        time_target,
+        precip_wet_total,
+        target_year=target_year,
+        land_only=land_only,
+        **cells,
+    )
+
+    # %% Save
+
+    save(precip_target_scaled, target_start, target_year=target_year)
+
+    # %% Plot
+
+    if plot:
+        if land_only:
+            precip_wet_clim = utils.unpack_land(
+                precip_wet_clim, utils.land_mask()
+            )
+        plot_scaling(
+            scaling_factor,
+            time_target,
+            precip_target,
+            precip_target_scaled,
+            precip_wet_clim,
+            wet_start_target,
+            wet_end_target,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,47 @@
-from pathlib import Path
+#!/usr/bin/env python
+"""Create BEPS input files for the experiment.
+
+With ``OUTPUT_FORMAT = "raw"``, the experiment is written as one raw binary
+file per variable instead of daily NetCDF files.
+
+If ``LAND_ONLY`` is set, only land cells are interpolated, and ocean cells
+are NaN in the output.
+
+With ``queue`` or a ``shard``, the NetCDF files are written in blocks of
+``BLOCK_DAYS`` days claimed through a work queue in the experiment directory
+(see ``workqueue``), so that several processes, also on different nodes with
+a shared filesystem, can create the experiment together. A shard ``i/n``
+restricts a process to the ``i``-th of ``n`` contiguous parts of the blocks,
+and only this part of the data is loaded. For example, on one machine::
 
-import numpy as np
+    for i in 0 1 2 3; do ./cli.py create-experiment --queue & done; wait
+    ./cli.py create-experiment --validate
+
+With ``validate``, only the completeness of the experiment is checked.
+Blocks that are done are skipped also with ``force``; remove the queue
+directory to write them again. Missing files are filled in by a run without
+queue.
+"""
+
+import functools
+from datetime import timedelta
+from pathlib import Path
 
 import config
 import ioutils
+import store
+import utils
+import workqueue
 
 INPUT_DIR = Path("output/select_data")
 INPUT_DIR_SCALED = Path("output/scale_precipitation")
 
 OUTPUT_DIR = Path("output/create_experiment")
 EXPERIMENT_NAME = "scaled_to_climatology"
+OUTPUT_FORMAT = "netcdf"  # or "raw"
+
+BLOCK_DAYS = 30
+QUEUE_DIR = ".queue"
 
 OUTPUT_VARIABLES = [
     "temp",
@@ -20,34 +52,185 @@ OUTPUT_VARIABLES = [
 ]
 
 
-# %% Load data
+def experiment_blocks(start, end, block_days=BLOCK_DAYS):
+    """Blocks of ``block_days`` days from ``start`` to ``end`` by block ID.
+
+    Each block is given as its first and last day (exclusive).
+
+    """
+    dates = ioutils.experiment_dates(start, end)
+    blocks = {}
+    for i in range(0, len(dates), block_days):
+        block_start = dates[i]
+        block_end = dates[min(i + block_days, len(dates)) - 1]
+        block_id = f"{block_start:%Y%m%d}-{block_end:%Y%m%d}"
+        blocks[block_id] = (block_start, block_end + timedelta(days=1))
+    return blocks
+
+
+def validate_experiment(exp_dir, start, end):
+    """Check that ``exp_dir`` has the BEPS files from ``start`` to ``end``."""
+    exp_dir = Path(exp_dir)
+    dates = ioutils.experiment_dates(start, end)
+    missing = [
+        date
+        for date in dates
+        if not (exp_dir / ioutils.beps_filename(date)).exists()
+    ]
+    partial = sorted(exp_dir.glob("*.tmp"))
+
+    for date in missing:
+        print(f"Missing: {ioutils.beps_filename(date)}")
+    for f in partial:
+        print(f"Incomplete: {f.name}")
+    print(
+        f"{exp_dir}: {len(dates) - len(missing)} of {len(dates)} days, "
+        f"{len(partial)} incomplete files"
+    )
+
+    return not missing and not partial
+
 
-variables = {}
-times = {}
-for variable in OUTPUT_VARIABLES:
-    if variable == "precip":
-        input_dir = INPUT_DIR_SCALED
+def run(
+    variables,
+    times,
+    lats,
+    lons,
+    start=config.EXP_START,
+    end=config.EXP_END,
+    experiment_name=EXPERIMENT_NAME,
+    force=False,
+    output_format=OUTPUT_FORMAT,
+    land_only=config.LAND_ONLY,
+    queue=False,
+    shard=None,
+):
+    """Write BEPS files for ``variables`` to the experiment directory.
+
+    With ``queue`` or ``shard``, the blocks are claimed through the work
+    queue, and the IDs of the blocks written by this process are returned.
+
+    """
+    if output_format == "raw":
+        create = ioutils.create_raw
+    elif output_format == "netcdf":
+        create = ioutils.create_netcdf
     else:
-        input_dir = INPUT_DIR
-    variables[variable] = np.load(input_dir / f"{variable}.npy")
-    times[variable] = np.load(
-        input_dir / f"time_{variable}.npy", allow_pickle=True
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    land_mask = None
+    if land_only:
+        land_mask = utils.land_mask()
+        variables = {
+            variable: utils.pack_land(values, land_mask)
+            for variable, values in variables.items()
+        }
+
+    OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
+    exp_dir = OUTPUT_DIR / experiment_name
+
+    if queue or shard is not None:
+        if output_format != "netcdf":
+            raise ValueError("Work queue requires NetCDF output")
+
+        blocks = experiment_blocks(start, end)
+        blocks = workqueue.select_shard(blocks, shard or "0/1")
+        create_block = functools.partial(
+            create,
+            exp_dir,
+            variables=variables,
+            times=times,
+            lats=lats,
+            lons=lons,
+            force=force,
+            land_mask=land_mask,
+        )
+        processed = workqueue.run(exp_dir / QUEUE_DIR, blocks, create_block)
+
+        pending = workqueue.pending(exp_dir / QUEUE_DIR, blocks)
+        print(
+            f"Wrote {len(processed)} of {len(blocks)} blocks, "
+            f"{len(pending)} blocks not done yet"
+        )
+        return processed
+
+    create(
+        output_dir=exp_dir,
+        start_date=start,
+        end_date=end,
+        variables=variables,
+        times=times,
+        lats=lats,
+        lons=lons,
+        force=force,
+        land_mask=land_mask,
     )
 
-lats = np.load(INPUT_DIR / "lats.npy")
-lons = np.load(INPUT_DIR / "lons.npy")
 
+def main(
+    start=config.EXP_START,
+    end=config.EXP_END,
+    experiment_name=EXPERIMENT_NAME,
+    force=False,
+    output_format=OUTPUT_FORMAT,
+    land_only=config.LAND_ONLY,
+    queue=False,
+    shard=None,
+    validate=False,
+):
+    if validate:
+        return validate_experiment(OUTPUT_DIR / experiment_name, start, end)
+
+    # %% Load data
+
+    # Load only the days of the shard and one day around them for the
+    # interpolation
+    load_range = {}
+    if shard is not None:
+        blocks = workqueue.select_shard(experiment_blocks(start, end), shard)
+        if not blocks:
+            print(f"No blocks in shard {shard}")
+            return
+        first_start, _ = next(iter(blocks.values()))
+        _, last_end = list(blocks.values())[-1]
+        load_range = dict(
+            start=first_start - timedelta(days=1),
+            end=last_end + timedelta(days=1),
+            include_endpoint=True,
+        )
+
+    variables = {}
+    times = {}
+    for variable in OUTPUT_VARIABLES:
+        if variable == "precip":
+            input_dir = INPUT_DIR_SCALED
+        else:
+            input_dir = INPUT_DIR
+        variables[variable] = store.load(input_dir, variable, **load_range)
+        times[variable] = store.load(
+            input_dir, f"time_{variable}", **load_range
+        )
+
+    lats = store.load(INPUT_DIR, "lats")
+    lons = store.load(INPUT_DIR, "lons")
+
+    # %% Save experiment
+
+    run(
+        variables,
+        times,
+        lats,
+        lons,
+        start=start,
+        end=end,
+        experiment_name=experiment_name,
+        force=force,
+        output_format=output_format,
+        land_only=land_only,
+        queue=queue,
+        shard=shard,
+    )
 
-# %% Save experiment
 
-OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
-exp_dir = OUTPUT_DIR / EXPERIMENT_NAME
-ioutils.create_netcdf(
-    output_dir=exp_dir,
-    start_date=config.EXP_START,
-    end_date=config.EXP_END,
-    variables=variables,
-    times=times,
-    lats=lats,
-    lons=lons,
-)
+if __name__ == "__main__":
+    main()
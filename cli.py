@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""Command-line entry point for all stages.
+
+Each stage is a subcommand, and the module constants of the stage can be
+overridden with options, for example::
+
+    ./cli.py select-data --start 1979-01-01 --end 2025-03-01 --no-debug
+    ./cli.py scale-precip --target-year 2023 --plot
+
+Stage modules are only imported when their subcommand is run, and plotting
+libraries only when a plot is requested.
+"""
+
+import argparse
+import importlib
+import sys
+from datetime import datetime
+
+STAGES = {
+    "preprocess-mswep": "00_preprocess_mswep",
+    "preprocess-mswx": "00_preprocess_mswx",
+    "concatenate": "01_concatenate_preprocessed_files",
+    "select-data": "02_select_data",
+    "window-mean": "03_calculate_temporal_window_mean",
+    "identify-seasons": "04_identify_dry_wet_seasons",
+    "extract-seasons": "05_extract_dry_wet_seasons",
+    "scale-precip": "06_scale_precipitation",
+    "create-experiment": "07_create_experiment",
+    "plot-precip": "plot_experiment_precip",
+    "verify": "verify_experiment",
+    "chain": "pipeline",
+}
+
+VARIABLES = ["temp", "precip", "rh", "swd", "wind"]
+OUTPUT_FORMATS = ["netcdf", "raw"]
+MSWX_VARIABLES = ["temp", "swd", "rh", "wind"]
+
+
+def parse_date(value):
+    return datetime.fromisoformat(value)
+
+
+def add_flag(parser, name, help):
+    parser.add_argument(
+        f"--{name}",
+        action=argparse.BooleanOptionalAction,
+        default=argparse.SUPPRESS,
+        help=help,
+    )
+
+
+def add_option(parser, name, type, help):
+    parser.add_argument(
+        f"--{name}", type=type, default=argparse.SUPPRESS, help=help
+    )
+
+
+def add_output_format(parser):
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default=argparse.SUPPRESS,
+        help="daily NetCDF files or one raw binary file per variable",
+    )
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    subparsers = parser.add_subparsers(dest="stage", required=True)
+
+    sub = subparsers.add_parser(
+        "preprocess-mswep", help="select area from MSWEP"
+    )
+    add_flag(sub, "rescan", "list source files even if unchanged")
+    sub.add_argument(
+        "--watch",
+        dest="watch_nrt",
+        action="store_true",
+        default=argparse.SUPPRESS,
+        help="keep processing new NRT files as they arrive",
+    )
+    add_option(sub, "interval", float, "seconds between polls (watch)")
+    add_option(sub, "max-workers", int, "concurrent CDO processes (watch)")
+    add_option(sub, "hook", str, "command to run after new files (watch)")
+
+    sub = subparsers.add_parser(
+        "preprocess-mswx", help="select area from MSWX"
+    )
+    sub.add_argument("variable", choices=MSWX_VARIABLES)
+    add_flag(sub, "rescan", "list source files even if unchanged")
+
+    sub = subparsers.add_parser("concatenate", help="index or concatenate")
+    sub.add_argument("variable", choices=VARIABLES)
+    add_flag(sub, "cat", "concatenate with CDO instead of indexing")
+
+    sub = subparsers.add_parser("select-data", help="select data")
+    add_option(sub, "start", parse_date, "first date (inclusive)")
+    add_option(sub, "end", parse_date, "last date (inclusive)")
+    add_flag(sub, "debug", "print precipitation in LA")
+    add_flag(sub, "plot", "plot the domain")
+
+    sub = subparsers.add_parser("window-mean", help="average over windows")
+    add_flag(sub, "debug", "print windows with unexpected length")
+    add_flag(sub, "per-cell", "also average each grid cell")
+    add_flag(sub, "land-only", "keep only land cells")
+
+    sub = subparsers.add_parser("identify-seasons", help="find dry season")
+    add_option(sub, "threshold", float, "precipitation threshold (mm/3hr)")
+    add_flag(sub, "per-cell", "also identify seasons for each grid cell")
+    add_flag(sub, "plot", "plot the seasons")
+
+    sub = subparsers.add_parser("extract-seasons", help="season climatology")
+    add_flag(sub, "per-cell", "also use the seasons of each grid cell")
+    add_flag(sub, "land-only", "keep only land cells")
+
+    sub = subparsers.add_parser("scale-precip", help="scale precipitation")
+    add_option(sub, "target-year", int, "year when the wet season starts")
+    add_flag(sub, "per-cell", "scale each grid cell over its own season")
+    add_flag(sub, "land-only", "keep only land cells")
+    add_flag(sub, "plot", "plot the scaling")
+
+    sub = subparsers.add_parser("create-experiment", help="create BEPS files")
+    add_option(sub, "start", parse_date, "first day")
+    add_option(sub, "end", parse_date, "last day (exclusive)")
+    add_option(sub, "experiment-name", str, "name of the output directory")
+    add_flag(sub, "land-only", "interpolate only land cells")
+    add_flag(sub, "force", "overwrite existing files")
+    add_output_format(sub)
+    add_flag(sub, "queue", "claim blocks of days through a work queue")
+    add_option(sub, "shard", str, "work only on shard i/n of the blocks")
+    add_flag(sub, "validate", "only check that all files exist")
+
+    sub = subparsers.add_parser("plot-precip", help="plot the experiment")
+    add_flag(sub, "batch", "render all figures in parallel without showing")
+
+    sub = subparsers.add_parser("verify", help="verify BEPS files")
+    sub.add_argument("experiment_dir", nargs="?", default=argparse.SUPPRESS)
+
+    sub = subparsers.add_parser("chain", help="run stages 02-07 in memory")
+    add_option(sub, "start", parse_date, "first date to select (inclusive)")
+    add_option(sub, "end", parse_date, "last date to select (inclusive)")
+    add_option(sub, "threshold", float, "precipitation threshold (mm/3hr)")
+    add_option(sub, "target-year", int, "year when the wet season starts")
+    add_flag(sub, "per-cell", "identify and scale seasons per grid cell")
+    add_flag(sub, "land-only", "keep only land cells in stages 03-07")
+    add_option(sub, "exp-start", parse_date, "first day of the experiment")
+    add_option(
+        sub, "exp-end", parse_date, "last day of the experiment (exclusive)"
+    )
+    add_option(sub, "experiment-name", str, "name of the output directory")
+    add_flag(sub, "force", "overwrite existing files")
+    add_output_format(sub)
+    add_flag(sub, "save", "also save the results of stages 02-06")
+
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = vars(parser.parse_args(argv))
+
+    stage = args.pop("stage")
+    module = importlib.import_module(STAGES[stage])
+    return module.main(**args)
+
+
+if __name__ == "__main__":
+    # Stages that check their results return False on failure
+    if main() is False:
+        sys.exit(1)
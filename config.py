@@ -3,5 +3,15 @@ from datetime import datetime
 AVERAGE_WINDOW_DAYS = 28
 OCEAN_THRESHOLD = 50
 
+# Identify dry and wet seasons per grid cell instead of for the whole domain
+PER_CELL_SEASONS = False
+
+# Keep only land cells, as (time, n_land) arrays, in stages 03-07. Ocean cells
+# are not scaled and are NaN in the BEPS files.
+LAND_ONLY = False
+
+LAT_LA = 34.05
+LON_LA = -118.25
+
 EXP_START = datetime(2019, 1, 1)
 EXP_END = datetime(2025, 3, 1)
@@ -0,0 +1,133 @@
+"""Precomputed diagnostics for plots and debug summaries.
+
+Time series of the domain mean and of the grid cell closest to LA, and their
+monthly means, are computed once when the data is produced. They are cached
+in ``CACHE_DIR`` together with the fingerprint of the store they were
+computed from, and recomputed if the store has changed since.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+import store
+from config import LAT_LA, LON_LA
+
+CACHE_DIR = Path("output/diagnostics")
+
+
+def nearest_index(lats, lons, lat, lon):
+    """Index of the grid cell closest to ``lat`` and ``lon``."""
+    j = np.argmin(np.abs(lats - lat))
+    i = np.argmin(np.abs(lons - lon))
+    return j, i
+
+
+def monthly_mean(series, time):
+    """Mean of ``series`` for each calendar month."""
+    months = np.asarray(time).astype("datetime64[M]").astype(int) % 12
+    sums = np.bincount(months, weights=series, minlength=12)
+    counts = np.bincount(months, minlength=12)
+    return sums / counts
+
+
+def time_series(values, lats, lons):
+    """Domain mean and LA time series of ``values`` (time, lat, lon)."""
+    j, i = nearest_index(lats, lons, LAT_LA, LON_LA)
+    return {
+        "domain_mean": np.nanmean(values, axis=(-1, -2)),
+        "point": values[:, j, i],
+    }
+
+
+def compute(values, time, lats, lons):
+    """Compute diagnostics of ``values`` with dimensions (time, lat, lon)."""
+    results = {"time": np.asarray(time).astype(store.TIME_DTYPE)}
+    results.update(time_series(values, lats, lons))
+    return add_monthly_means(results)
+
+
+def add_monthly_means(results):
+    """Add monthly means of the time series in ``results``."""
+    time = results["time"]
+    results["monthly_domain_mean"] = monthly_mean(results["domain_mean"], time)
+    results["monthly_point"] = monthly_mean(results["point"], time)
+    return results
+
+
+def cache_path(stage_dir, name):
+    """Path of the cached diagnostics of ``name`` in ``stage_dir``."""
+    return CACHE_DIR / f"{Path(stage_dir).name}_{name}.npz"
+
+
+def update(stage_dir, name, values, time, lats, lons):
+    """Compute diagnostics of ``values`` and cache them.
+
+    ``values`` should be what is saved as ``name`` in the store in
+    ``stage_dir``, which must be written before calling this function.
+
+    """
+    results = compute(values, time, lats, lons)
+    save(stage_dir, name, results)
+    return results
+
+
+def update_window(stage_dir, name, base, values, start, lats, lons):
+    """Compute diagnostics of data modified in a time window and cache them.
+
+    ``base`` are the diagnostics of the data before it was modified, and
+    ``values`` replaces the time steps from index ``start``. Only the window
+    is processed.
+
+    """
+    stop = start + len(values)
+    window = time_series(values, lats, lons)
+
+    results = {
+        key: base[key].copy() for key in ["time", "domain_mean", "point"]
+    }
+    for key in ["domain_mean", "point"]:
+        results[key][start:stop] = window[key]
+    results = add_monthly_means(results)
+
+    save(stage_dir, name, results)
+    return results
+
+
+def save(stage_dir, name, results):
+    """Cache diagnostics ``results`` of ``name`` in ``stage_dir``."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    np.savez(
+        cache_path(stage_dir, name),
+        fingerprint=store.fingerprint(stage_dir),
+        **results,
+    )
+
+
+def load(stage_dir, name, lats_dir=None):
+    """Load cached diagnostics of ``name`` in the store in ``stage_dir``.
+
+    If the cache is missing or out of date, the diagnostics are computed from
+    the store and cached. Coordinates are read from ``lats_dir`` if they are
+    not part of the store in ``stage_dir``.
+
+    """
+    path = cache_path(stage_dir, name)
+    if path.exists():
+        with np.load(path) as cache:
+            if cache["fingerprint"] == store.fingerprint(stage_dir):
+                return {
+                    key: cache[key]
+                    for key in cache.files
+                    if key != "fingerprint"
+                }
+
+    lats_dir = stage_dir if lats_dir is None else lats_dir
+    return update(
+        stage_dir,
+        name,
+        store.load(stage_dir, name),
+        store.load(stage_dir, f"time_{name}"),
+        store.load(lats_dir, "lats"),
+        store.load(lats_dir, "lons"),
+    )
@@ -2,8 +2,18 @@
 
 Daily netCDF files with all metetorology variables for BEPS.
 Also linearly interpolate to hourly values.
+
+Alternatively, the hourly values of the whole experiment are written to one
+raw binary file per variable, with dimensions (time, lat, lon) in C order,
+described by a JSON header. The files can be memory-mapped with
+:func:`read_raw` or ``numpy.memmap``.
 """
 
+import json
+import os
+import queue
+import threading
+import uuid
 from datetime import timedelta
 from pathlib import Path
 
@@ -17,6 +27,62 @@ import utils
 INPUT_DIR = Path("output/experiments")
 OUTPUT_DIR = Path("output/netcdf")
 
+OUTPUT_VARIABLES = {
+    "PRCP": "precip",
+    "RH": "rh",
+    "SSRD": "swd",
+    "T": "temp",
+    "WS": "wind",
+}
+
+VARIABLE_UNITS = {
+    "PRCP": "mm/h",
+    "RH": " ",
+    "SSRD": "W/m2",
+    "T": "K",
+    "WS": "m/s",
+}
+
+VARIABLE_DTYPES = {
+    "PRCP": "f4",
+    "RH": "f8",
+    "SSRD": "f8",
+    "T": "f8",
+    "WS": "f8",
+}
+
+FILENAME_FORMAT = "beps_meteo_0.1_%Y%m%d.nc"
+RAW_HEADER = "header.json"
+
+# Maximum number of interpolated days waiting to be written
+QUEUE_SIZE = 8
+
+OUTPUT_HOURS = np.arange(24, dtype=int)
+
+
+def beps_filename(date):
+    """Name of the BEPS file for ``date``."""
+    return date.strftime(FILENAME_FORMAT)
+
+
+def convert_units(variables):
+    """Convert ``variables`` to the units used by BEPS.
+
+    Returns a new dictionary, the arrays in ``variables`` are not modified.
+
+    """
+    variables = variables.copy()
+
+    # Convert temperature to kelvin
+    if "temp" in variables:
+        variables["temp"] = variables["temp"] + 273.15
+
+    # Convert RH % to fraction
+    if "rh" in variables:
+        variables["rh"] = variables["rh"] / 100.0
+
+    return variables
+
 
 def interp_precip(x, xp, yp):
     """Interpolate 3-hourly precipitation (mm/3hr) to hourly (mm/hr).
@@ -25,53 +91,40 @@ def interp_precip(x, xp, yp):
     precipitation in 3-hour bins match the 3-hourly precipitation at the end of
     the bin.
 
-    Currently hard-coded for 3-dimensional ``yp`` corresponding to
-    (time, lat, lon).
+    The first dimension of ``yp`` is time, the others are grid cells, for
+    example (lat, lon) or (n_land).
 
     """
-    res = np.zeros(x.shape + yp.shape[1:])
+    cells = yp.reshape(yp.shape[0], -1)
+    res = np.zeros(x.shape + cells.shape[1:])
 
     # Extended x array to include margins
     xx = np.arange(xp[0], xp[-1] + 1)
     sel = np.isin(xx, x)
 
-    for j in range(yp.shape[1]):
-        for i in range(yp.shape[2]):
-            interp_func = interp1d(xp, yp[:, j, i], kind="linear", axis=0)
-            y = interp_func(xx)
+    for i in range(cells.shape[1]):
+        interp_func = interp1d(xp, cells[:, i], kind="linear", axis=0)
+        y = interp_func(xx)
 
-            for xi, yi in zip(xp, yp[:, j, i], strict=True):
-                bin = (xx > xi - 3) & (xx <= xi)
+        for xi, yi in zip(xp, cells[:, i], strict=True):
+            bin = (xx > xi - 3) & (xx <= xi)
 
-                if yi == 0:  # to avoid division by zero warning
-                    y[bin] = 0
-                else:
-                    y[bin] = y[bin] * (yi / y[bin].sum())
+            if yi == 0:  # to avoid division by zero warning
+                y[bin] = 0
+            else:
+                y[bin] = y[bin] * (yi / y[bin].sum())
 
-            res[:, j, i] = y[sel]
+        res[:, i] = y[sel]
 
-    return res
+    return res.reshape(x.shape + yp.shape[1:])
 
 
-def create_netcdf(
-    output_dir, start_date, end_date, variables, times, lats, lons, force=False
-):
-    OUTPUT_VARIABLES = {
-        "PRCP": "precip",
-        "RH": "rh",
-        "SSRD": "swd",
-        "T": "temp",
-        "WS": "wind",
-    }
+def experiment_dates(start_date, end_date):
+    """Days from ``start_date`` to ``end_date`` (exclusive) without leap days.
 
-    VARIABLE_UNITS = {
-        "PRCP": "mm/h",
-        "RH": " ",
-        "SSRD": "W/m2",
-        "T": "K",
-        "WS": "m/s",
-    }
+    Both dates are set to the start of the day.
 
+    """
     start_of_start_date = start_date.replace(
         hour=0, minute=0, second=0, microsecond=0
     )
@@ -86,119 +139,306 @@ def create_netcdf(
         print("warning: Setting end_date to start of the day")
         end_date = start_of_end_date
 
-    output_dir = Path(output_dir)
-    variables = variables.copy()
-
-    dates = [
+    return [
         date
         for date in utils.iterdates(start_date, end_date, timedelta(days=1))
+        if not (date.month == 2 and date.day == 29)
     ]
-    output_hours = np.arange(24, dtype=int)
 
-    # Convert temperature to kelvin
-    if "temp" in variables:
-        variables["temp"] = variables["temp"] + 273.15
 
-    # Convert RH % to fraction
-    if "rh" in variables:
-        variables["rh"] = variables["rh"] / 100.0
+def interpolate_day(date, variables, times, sorted_times, land_mask=None):
+    """Interpolate ``variables`` (with BEPS units) to the hours of ``date``.
 
-    output_dir.mkdir(exist_ok=True, parents=True)
+    ``sorted_times`` tells for each variable whether its time axis is sorted.
+    If ``land_mask`` is given, ``variables`` contain only the land cells (see
+    :func:`utils.pack_land`), and the results are unpacked with NaN over the
+    ocean.
+
+    """
+    # Select data
+    end = date + timedelta(days=1)
+
+    # If the selection ends on a leap day, we need to skip to the next day
+    # because we have removed all leap days
+    if end.month == 2 and end.day == 29:
+        end = end + timedelta(days=1)
+
+    variables_current = {}
+    hours_current = {}
+    for variable, values in variables.items():
+        start = date
+
+        # For precipitation, we need to include the previous 3-hour bin to
+        # calculate the adjustment
+        if variable == "precip":
+            start = start - timedelta(hours=3)
+
+        time = times[variable]
+        options = dict(
+            start=start,
+            end=end,
+            include_endpoint=True,
+            assume_sorted=sorted_times[variable],
+        )
+        variables_current[variable] = utils.select_time(
+            values, time, **options
+        )
+        time_current = utils.select_time(time, time, **options)
+        hours_current[variable] = np.array(
+            [
+                int(delta.total_seconds() / 60 / 60)
+                for delta in time_current - date
+            ]
+        )
+
+    # Interpolate
+    interpolated_variables = {}
+    for variable, values in variables_current.items():
+        hours = hours_current[variable]
+        if variable == "precip":
+            interp_values = interp_precip(OUTPUT_HOURS, hours, values)
+        else:
+            interp = interp1d(hours, values, kind="linear", axis=0)
+            interp_values = interp(OUTPUT_HOURS)
+        if land_mask is not None:
+            interp_values = utils.unpack_land(interp_values, land_mask)
+        interpolated_variables[variable] = interp_values
+
+    return interpolated_variables
+
+
+def write_netcdf(outfile, date, interpolated_variables, lats, lons):
+    """Write the hourly ``interpolated_variables`` of ``date`` to ``outfile``.
+
+    The file is written under a temporary name unique to this writer and
+    renamed when complete.
+
+    """
+    outfile = Path(outfile)
+    tmp_file = outfile.with_name(
+        f"{outfile.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    )
 
-    for date in tqdm(dates):
-        # Skip leap days
-        if date.month == 2 and date.day == 29:
+    ncfile = nc.Dataset(
+        tmp_file,
+        mode="w",
+        format="NETCDF4",
+    )
+    ncfile.createDimension("time", None)
+    ncfile.createDimension("lat", lats.size)
+    ncfile.createDimension("lon", lons.size)
+
+    nc_time = ncfile.createVariable("time", "f4", ("time",))
+    time_units = (
+        f"hours since {date.year}-{date.month:02d}-{date.day:02d} 00:00:00"
+    )
+    nc_time.units = time_units
+    nc_time.calendar = "gregorian"
+    nc_time[:] = OUTPUT_HOURS
+
+    nc_lat = ncfile.createVariable("lat", "f4", ("lat",))
+    nc_lat.units = "degrees_north"
+    nc_lat[:] = lats
+
+    nc_lon = ncfile.createVariable("lon", "f4", ("lon",))
+    nc_lon.units = "degrees_east"
+    nc_lon[:] = lons
+
+    for output_variable, variable in OUTPUT_VARIABLES.items():
+        if variable not in interpolated_variables:
             continue
 
-        filename = (
-            f"beps_meteo_0.1_{date.year}{date.month:02d}{date.day:02d}.nc"
+        nc_var = ncfile.createVariable(
+            output_variable,
+            VARIABLE_DTYPES[output_variable],
+            ("time", "lat", "lon"),
         )
-        outfile = output_dir / filename
+        nc_var.units = VARIABLE_UNITS[output_variable]
+        nc_var[:] = interpolated_variables[variable]
+
+    ncfile.close()
+    tmp_file.replace(outfile)
 
-        if outfile.exists() and not force:
+
+def _write_queued(tasks, lats, lons, errors):
+    """Write the days in queue ``tasks`` until ``None`` is received."""
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        if errors:
+            # Keep draining the queue so that the producer is not blocked
             continue
+        try:
+            write_netcdf(*task, lats, lons)
+        except Exception as error:
+            errors.append(error)
 
-        # Select data
-        end = date + timedelta(days=1)
 
-        # If the selection ends on a leap day, we need to skip to the next day
-        # because we have removed all leap days
-        if end.month == 2 and end.day == 29:
-            end = end + timedelta(days=1)
+def create_netcdf(
+    output_dir,
+    start_date,
+    end_date,
+    variables,
+    times,
+    lats,
+    lons,
+    force=False,
+    land_mask=None,
+    queue_size=QUEUE_SIZE,
+):
+    """Write one BEPS file per day from ``start_date`` to ``end_date``.
 
-        variables_current = {}
-        hours_current = {}
-        for variable, values in variables.items():
-            start = date
+    The days are interpolated in this thread while a writer thread writes
+    the finished days, with at most ``queue_size`` days waiting to be
+    written.
 
-            # For precipitation, we need to include the previous 3-hour bin to
-            # calculate the adjustment
-            if variable == "precip":
-                start = start - timedelta(hours=3)
+    """
+    output_dir = Path(output_dir)
 
-            time = times[variable]
-            variables_current[variable] = utils.select_time(
-                values, time, start=start, end=end, include_endpoint=True
-            )
-            time_current = utils.select_time(
-                time, time, start=start, end=end, include_endpoint=True
-            )
-            hours_current[variable] = np.array(
-                [
-                    int(delta.total_seconds() / 60 / 60)
-                    for delta in time_current - date
-                ]
-            )
+    dates = experiment_dates(start_date, end_date)
 
-        # Interpolate
-        interpolated_variables = {}
-        for variable, values in variables_current.items():
-            hours = hours_current[variable]
-            if variable == "precip":
-                interp_values = interp_precip(output_hours, hours, values)
-            else:
-                interp = interp1d(hours, values, kind="linear", axis=0)
-                interp_values = interp(output_hours)
-            interpolated_variables[variable] = interp_values
-
-        # Create netCDF
-        ncfile = nc.Dataset(
-            outfile,
-            mode="w",
-            format="NETCDF4",
-        )
-        ncfile.createDimension("time", None)
-        ncfile.createDimension("lat", lats.size)
-        ncfile.createDimension("lon", lons.size)
+    variables = convert_units(variables)
 
-        nc_time = ncfile.createVariable("time", "f4", ("time",))
-        time_units = (
-            f"hours since {date.year}-{date.month:02d}-{date.day:02d} 00:00:00"
-        )
-        nc_time.units = time_units
-        nc_time.calendar = "gregorian"
-        nc_time[:] = output_hours
+    output_dir.mkdir(exist_ok=True, parents=True)
 
-        nc_lat = ncfile.createVariable("lat", "f4", ("lat",))
-        nc_lat.units = "degrees_north"
-        nc_lat[:] = lats
+    # Check once so that the daily selections can use binary search
+    sorted_times = {
+        variable: utils.is_sorted(time) for variable, time in times.items()
+    }
 
-        nc_lon = ncfile.createVariable("lon", "f4", ("lon",))
-        nc_lon.units = "degrees_east"
-        nc_lon[:] = lons
+    tasks = queue.Queue(maxsize=queue_size)
+    errors = []
+    writer = threading.Thread(
+        target=_write_queued, args=(tasks, lats, lons, errors)
+    )
+    writer.start()
 
-        for output_variable, variable in OUTPUT_VARIABLES.items():
-            if variable not in variables:
+    try:
+        for date in tqdm(dates):
+            if errors:
+                break
+
+            outfile = output_dir / beps_filename(date)
+
+            if outfile.exists() and not force:
                 continue
 
-            if variable == "precip":
-                datatype = "f4"
-            else:
-                datatype = "f8"
-            nc_var = ncfile.createVariable(
-                output_variable, datatype, ("time", "lat", "lon")
+            interpolated_variables = interpolate_day(
+                date, variables, times, sorted_times, land_mask
             )
-            nc_var.units = VARIABLE_UNITS[output_variable]
-            nc_var[:] = interpolated_variables[variable]
+            tasks.put((outfile, date, interpolated_variables))
+    finally:
+        tasks.put(None)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def create_raw(
+    output_dir,
+    start_date,
+    end_date,
+    variables,
+    times,
+    lats,
+    lons,
+    force=False,
+    land_mask=None,
+):
+    """Write the experiment to one raw binary file per variable.
+
+    The header in ``RAW_HEADER`` describes the shape, the data type and file
+    of each variable, the days (24 hours each, without leap days), and the
+    latitudes and longitudes. It is written last, so that an interrupted
+    export has no header.
+
+    """
+    output_dir = Path(output_dir)
+    header_file = output_dir / RAW_HEADER
+
+    if header_file.exists() and not force:
+        print(f"warning: {header_file} exists, skipping raw export")
+        return
+
+    dates = experiment_dates(start_date, end_date)
+    shape = (len(dates) * OUTPUT_HOURS.size, lats.size, lons.size)
+
+    variables = convert_units(variables)
+
+    output_dir.mkdir(exist_ok=True, parents=True)
+    header_file.unlink(missing_ok=True)
+
+    sorted_times = {
+        variable: utils.is_sorted(time) for variable, time in times.items()
+    }
+
+    header = {
+        "shape": list(shape),
+        "order": "C",
+        "dimensions": ["time", "lat", "lon"],
+        "start": dates[0].isoformat(),
+        "time_step_hours": 1,
+        "days": [date.strftime("%Y-%m-%d") for date in dates],
+        "lat": np.asarray(lats).tolist(),
+        "lon": np.asarray(lons).tolist(),
+        "variables": {},
+    }
+
+    outputs = {}
+    for output_variable, variable in OUTPUT_VARIABLES.items():
+        if variable not in variables:
+            continue
+
+        # Little-endian, so that the layout does not depend on the machine
+        dtype = np.dtype(VARIABLE_DTYPES[output_variable]).newbyteorder("<")
+        filename = f"{output_variable}.bin"
+        outputs[variable] = np.memmap(
+            output_dir / filename, dtype=dtype, mode="w+", shape=shape
+        )
+        header["variables"][output_variable] = {
+            "file": filename,
+            "dtype": dtype.str,
+            "units": VARIABLE_UNITS[output_variable],
+        }
+
+    for iday, date in enumerate(tqdm(dates)):
+        interpolated_variables = interpolate_day(
+            date, variables, times, sorted_times, land_mask
+        )
+        hours = slice(iday * OUTPUT_HOURS.size, (iday + 1) * OUTPUT_HOURS.size)
+        for variable, values in outputs.items():
+            values[hours] = interpolated_variables[variable]
+
+    for values in outputs.values():
+        values.flush()
+    del outputs
+
+    tmp_file = header_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(header, f, indent=1)
+    tmp_file.replace(header_file)
+
+
+def read_raw(output_dir, mode="r"):
+    """Memory-map the raw export in ``output_dir``.
+
+    Returns the header and a dictionary with an array for each BEPS variable.
+
+    """
+    output_dir = Path(output_dir)
+    with open(output_dir / RAW_HEADER) as f:
+        header = json.load(f)
+
+    variables = {
+        name: np.memmap(
+            output_dir / entry["file"],
+            dtype=entry["dtype"],
+            mode=mode,
+            shape=tuple(header["shape"]),
+        )
+        for name, entry in header["variables"].items()
+    }
 
-        ncfile.close()
+    return header, variables
@@ -0,0 +1,224 @@
+"""Manifest of the source files processed by the preprocessing scripts.
+
+The manifest is an SQLite database with one row per source file recording its
+size, modification time and checksum, the output file, and the status,
+duration and error of the last time it was processed. It is opened in WAL
+mode, so that parallel workers can update it while others read it.
+
+Listing a source directory is skipped if its modification time did not change
+since the last scan, in which case the files known to the manifest are used.
+"""
+
+import hashlib
+import sqlite3
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+MANIFEST_FILE = Path("log/manifest.sqlite")
+TIMEOUT = 60  # seconds to wait for other workers holding a lock
+
+# Number of bytes read at a time for the checksum
+CHECKSUM_BYTES = 1 << 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    source TEXT PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    checksum TEXT,
+    output TEXT,
+    status TEXT NOT NULL,
+    duration REAL,
+    error TEXT,
+    updated TEXT
+);
+CREATE INDEX IF NOT EXISTS files_status ON files (dataset, status);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+"""
+
+PENDING = ("new", "changed", "error")
+
+
+def connect(path=MANIFEST_FILE):
+    """Open the manifest at ``path``, creating it if needed."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    conn = sqlite3.connect(path, timeout=TIMEOUT)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+
+    return conn
+
+
+def checksum(path):
+    """Checksum of the whole content of a file."""
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHECKSUM_BYTES):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def scan(conn, dataset, source_dir, output_dir, rescan=False):
+    """Update the manifest with the ``*.nc`` files in ``source_dir``.
+
+    New files and files with a different size, or a different modification
+    time and checksum, are marked for processing. The checksum is only
+    computed if the size is the same. Files without entry whose output
+    already exists are marked as done. If ``rescan`` is False and the
+    directory did not change since the last scan, it is not listed again.
+
+    """
+    source_dir = Path(source_dir)
+    output_dir = Path(output_dir)
+
+    dir_mtime = source_dir.stat().st_mtime_ns
+    row = conn.execute(
+        "SELECT mtime_ns FROM directories WHERE path = ?", (str(source_dir),)
+    ).fetchone()
+    if not rescan and row is not None and row[0] == dir_mtime:
+        return
+
+    known = {
+        source: (size, mtime_ns, checksum_, status)
+        for source, size, mtime_ns, checksum_, status in conn.execute(
+            "SELECT source, size, mtime_ns, checksum, status FROM files "
+            "WHERE dataset = ?",
+            (dataset,),
+        )
+    }
+
+    rows = []
+    for f in sorted(source_dir.glob("*.nc")):
+        stat = f.stat()
+        output_file = output_dir / f.name
+
+        entry = known.get(str(f))
+        if entry is None:
+            # The checksum is computed when the file is processed
+            new_checksum = None
+            status = "done" if output_file.exists() else "new"
+        else:
+            size, mtime_ns, new_checksum, status = entry
+            if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                continue
+            # Only the metadata changed if the content is the same
+            if size != stat.st_size or checksum(f) != new_checksum:
+                new_checksum = None
+                status = "changed"
+
+        rows.append(
+            (
+                str(f),
+                dataset,
+                stat.st_size,
+                stat.st_mtime_ns,
+                new_checksum,
+                str(output_file),
+                status,
+                _now(),
+            )
+        )
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO files "
+            "(source, dataset, size, mtime_ns, checksum, output, status, "
+            "updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (source) DO UPDATE SET "
+            "size = excluded.size, mtime_ns = excluded.mtime_ns, "
+            "checksum = excluded.checksum, output = excluded.output, "
+            "status = excluded.status, updated = excluded.updated",
+            rows,
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?)",
+            (str(source_dir), dir_mtime),
+        )
+
+
+def pending(conn, dataset):
+    """Source and output files of ``dataset`` that need to be processed."""
+    placeholders = ", ".join("?" * len(PENDING))
+    rows = conn.execute(
+        "SELECT source, output FROM files "
+        f"WHERE dataset = ? AND status IN ({placeholders}) ORDER BY source",
+        (dataset, *PENDING),
+    )
+    return [(Path(source), Path(output)) for source, output in rows]
+
+
+def errors(conn, dataset):
+    """Source files of ``dataset`` that could not be processed."""
+    rows = conn.execute(
+        "SELECT source, error FROM files "
+        "WHERE dataset = ? AND status = 'error' ORDER BY source",
+        (dataset,),
+    )
+    return rows.fetchall()
+
+
+def record(conn, source, status, duration=None, error=None):
+    """Record the result of processing ``source``."""
+    stat = Path(source).stat()
+    with conn:
+        conn.execute(
+            "UPDATE files SET size = ?, mtime_ns = ?, checksum = ?, "
+            "status = ?, duration = ?, error = ?, updated = ? "
+            "WHERE source = ?",
+            (
+                stat.st_size,
+                stat.st_mtime_ns,
+                checksum(source),
+                status,
+                duration,
+                error,
+                _now(),
+                str(source),
+            ),
+        )
+
+
+def run(conn, source, output_file, command):
+    """Run ``command`` on ``source`` and record the result.
+
+    The output is written under a temporary name and only replaces
+    ``output_file`` if ``command`` succeeds, so that a previous output is
+    kept otherwise.
+
+    """
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(output_file.name + ".tmp")
+    tmp_file.unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        command + [source, tmp_file],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    duration = time.perf_counter() - start
+
+    if result.returncode != 0:
+        # Do not leave incomplete output behind
+        tmp_file.unlink(missing_ok=True)
+        error = result.stderr.strip() or f"exit status {result.returncode}"
+        record(conn, source, "error", duration, error)
+    else:
+        tmp_file.replace(output_file)
+        record(conn, source, "done", duration)
+
+    return result.returncode == 0
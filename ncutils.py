@@ -0,0 +1,319 @@
+"""Utils to read the concatenated NetCDF files in ``data``.
+
+Instead of a concatenated file, a variable can also have an index
+``<varname>.index.json`` of the preprocessed files with the time coverage of
+each file (see :func:`build_index`). Only the files overlapping the requested
+date range are then read. The decoded time axes of all indexed files are saved
+next to the index in ``<varname>.index.time.npz``, so that they are not
+decoded again when the files are read.
+
+Decoded time axes of concatenated files are cached in ``TIME_CACHE_DIR`` as
+``datetime64`` arrays, one cache file per path together with a key of the
+size and modification time of the file and the units of the time axis. A file
+that is rewritten therefore replaces its cache entry.
+"""
+
+import hashlib
+import json
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+import store
+
+DATA_DIR = Path("data")
+INDEX_SUFFIX = ".index.json"
+INDEX_TIME_SUFFIX = ".index.time.npz"
+TIME_CACHE_DIR = Path("output/time_cache")
+
+NETCDF_NAMES = {
+    "temp": "air_temperature",
+    "precip": "precipitation",
+    "rh": "relative_humidity",
+    "swd": "downward_shortwave_radiation",
+    "wind": "wind_speed",
+}
+
+
+def _time_cache_file(path):
+    key = str(Path(path).resolve())
+    return TIME_CACHE_DIR / f"{hashlib.sha1(key.encode()).hexdigest()}.npz"
+
+
+def clear_time_cache(path):
+    """Remove cached time axis of ``path``."""
+    _time_cache_file(path).unlink(missing_ok=True)
+
+
+def decode_time(path, time, cache=True):
+    """Decode NetCDF variable ``time`` of file ``path`` to datetime objects.
+
+    If ``cache`` is True, the decoded time axis is read from the cache if
+    available, and saved to it otherwise.
+
+    """
+    if not cache:
+        return nc.num2date(
+            time[:], time.units, only_use_cftime_datetimes=False
+        )
+
+    key = f"{store.fingerprint(path)}:{time.units}"
+    cache_file = _time_cache_file(path)
+
+    if cache_file.exists():
+        with np.load(cache_file) as f:
+            if f["key"] == key:
+                return f["time"].astype(object)
+
+    dates = nc.num2date(time[:], time.units, only_use_cftime_datetimes=False)
+
+    TIME_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix(".tmp.npz")
+    np.savez(
+        tmp_file,
+        key=key,
+        time=np.asarray(dates).astype(store.TIME_DTYPE),
+    )
+    tmp_file.replace(cache_file)
+
+    return dates
+
+
+def index_path(varname, data_dir=DATA_DIR):
+    return Path(data_dir) / f"{varname}{INDEX_SUFFIX}"
+
+
+def index_time_path(varname, data_dir=DATA_DIR):
+    return Path(data_dir) / f"{varname}{INDEX_TIME_SUFFIX}"
+
+
+def source_path(varname, data_dir=DATA_DIR):
+    """Index of ``varname`` if it exists, otherwise the concatenated file."""
+    path = index_path(varname, data_dir)
+    if path.exists():
+        return path
+    return Path(data_dir) / f"{varname}.nc"
+
+
+def read_index(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_index_time(index, varname, data_dir=DATA_DIR):
+    """Decoded time axes of the files in ``index`` as ``datetime64``.
+
+    Each file of the index covers ``ntime`` time steps from ``offset``.
+    Returns None if the time axes are missing or do not belong to ``index``.
+
+    """
+    path = index_time_path(varname, data_dir)
+    if "time_key" not in index or not path.exists():
+        return None
+    with np.load(path) as f:
+        if f["key"] != index["time_key"]:
+            return None
+        return f["time"]
+
+
+def _is_unchanged(entry):
+    """Check if the file of index ``entry`` has the same size and mtime."""
+    try:
+        stat = Path(entry["file"]).stat()
+    except FileNotFoundError:
+        return False
+    return (entry["size"], entry["mtime_ns"]) == (
+        stat.st_size,
+        stat.st_mtime_ns,
+    )
+
+
+def build_index(varname, input_dir, data_dir=DATA_DIR):
+    """Index the time coverage of the NetCDF files in ``input_dir``.
+
+    Files with the same size and modification time as in the previous index
+    are not opened again. The files are sorted by their first time step, and
+    their decoded time axes are saved with the index.
+
+    """
+    path = index_path(varname, data_dir)
+
+    previous = {}
+    previous_time = None
+    if path.exists():
+        index = read_index(path)
+        previous = {entry["file"]: entry for entry in index["files"]}
+        previous_time = read_index_time(index, varname, data_dir)
+
+    entries = []
+    times = {}
+    for f in sorted(Path(input_dir).glob("*.nc")):
+        f = f.resolve()
+        stat = f.stat()
+
+        entry = previous.get(str(f))
+        if (
+            entry is not None
+            and previous_time is not None
+            and (entry["size"], entry["mtime_ns"])
+            == (stat.st_size, stat.st_mtime_ns)
+        ):
+            offset = entry["offset"]
+            times[str(f)] = previous_time[offset : offset + entry["ntime"]]
+            entries.append(entry)
+            continue
+
+        with nc.Dataset(f) as ncfile:
+            dates = decode_time(f, ncfile.variables["time"], cache=False)
+
+        times[str(f)] = np.asarray(dates).astype(store.TIME_DTYPE)
+        entries.append(
+            {
+                "file": str(f),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "time_start": dates[0].isoformat(),
+                "time_end": dates[-1].isoformat(),
+                "ntime": len(dates),
+            }
+        )
+
+    entries.sort(key=lambda entry: entry["time_start"])
+
+    for prev, entry in zip(entries[:-1], entries[1:], strict=True):
+        if entry["time_start"] <= prev["time_end"]:
+            print(f"warning: {entry['file']} overlaps {prev['file']}")
+
+    offset = 0
+    for entry in entries:
+        entry["offset"] = offset
+        offset += entry["ntime"]
+
+    Path(data_dir).mkdir(exist_ok=True, parents=True)
+
+    # The index only uses time axes saved with the same key
+    time_key = uuid.uuid4().hex
+    time_path = index_time_path(varname, data_dir)
+    tmp_file = time_path.with_name(f"{time_path.stem}.tmp.npz")
+    time = [times[entry["file"]] for entry in entries]
+    np.savez(
+        tmp_file,
+        key=time_key,
+        time=np.concatenate(time) if time else np.array([], store.TIME_DTYPE),
+    )
+    tmp_file.replace(time_path)
+
+    tmp_file = path.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(
+            {"variable": varname, "time_key": time_key, "files": entries},
+            f,
+            indent=1,
+        )
+    tmp_file.replace(path)
+
+    return entries
+
+
+def _read_file(path, varname, coords=False, dates=None, cache=True):
+    """Read ``varname`` from ``path``, decoding the time axis if not given."""
+    lats = None
+    lons = None
+
+    with nc.Dataset(path) as ncfile:
+        ncfile.set_auto_mask(False)
+
+        values = ncfile.variables[NETCDF_NAMES[varname]][:]
+        if dates is None:
+            dates = decode_time(path, ncfile.variables["time"], cache)
+
+        if coords:
+            lats = ncfile.variables["lat"][:]
+            lons = ncfile.variables["lon"][:]
+
+    return values, dates, lats, lons
+
+
+def read_variable(
+    varname, data_dir=DATA_DIR, coords=False, start=None, end=None
+):
+    """Read values and decoded time axis of ``varname``.
+
+    If ``coords`` is True, also read latitudes and longitudes, otherwise
+    ``None`` is returned for them. If ``varname`` has an index, only the
+    files overlapping ``start`` to ``end`` (inclusive) are read, otherwise
+    the whole concatenated file is read.
+
+    """
+    path = index_path(varname, data_dir)
+    if not path.exists():
+        return _read_file(Path(data_dir) / f"{varname}.nc", varname, coords)
+
+    start = start.isoformat() if start is not None else ""
+    end = end.isoformat() if end is not None else "9999"
+    index = read_index(path)
+    entries = [
+        entry
+        for entry in index["files"]
+        if entry["time_start"] <= end and entry["time_end"] >= start
+    ]
+    if not entries:
+        raise ValueError(f"No {varname} files between {start} and {end}")
+
+    # Files changed since the index was built are decoded again
+    index_time = read_index_time(index, varname, data_dir)
+    results = []
+    for i, entry in enumerate(entries):
+        dates = None
+        if index_time is not None and _is_unchanged(entry):
+            offset = entry["offset"]
+            dates = index_time[offset : offset + entry["ntime"]]
+            dates = dates.astype(object)
+        results.append(
+            _read_file(
+                entry["file"], varname, coords and i == 0, dates, cache=False
+            )
+        )
+    values = np.concatenate([result[0] for result in results])
+    dates = np.concatenate([result[1] for result in results])
+    _, _, lats, lons = results[0]
+
+    return values, dates, lats, lons
+
+
+def load_variables(
+    varnames, data_dir=DATA_DIR, max_workers=None, start=None, end=None
+):
+    """Read ``varnames`` concurrently, one worker process per variable.
+
+    Decompression and time decoding are done in the workers. ``start`` and
+    ``end`` are passed to :func:`read_variable`. Returns dictionaries with
+    values and dates for each variable, and the latitudes and longitudes of
+    the first variable.
+
+    """
+    varnames = list(varnames)
+    if max_workers is None:
+        max_workers = len(varnames)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                read_variable, varname, data_dir, i == 0, start, end
+            )
+            for i, varname in enumerate(varnames)
+        ]
+        results = [future.result() for future in futures]
+
+    variables = {}
+    dates = {}
+    for varname, (values, time, _, _) in zip(varnames, results, strict=True):
+        variables[varname] = values
+        dates[varname] = time
+
+    _, _, lats, lons = results[0]
+
+    return variables, dates, lats, lons
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Run stages 02 to 07 in one process.
+
+The arrays are passed from one stage to the next in memory, so that the
+concatenated NetCDF files are read once and the stores are not read at all.
+The results of the intermediate stages are only saved to their stores if
+``save`` is True.
+"""
+
+import importlib
+
+import config
+import ncutils
+import utils
+
+select_data = importlib.import_module("02_select_data")
+window_mean = importlib.import_module("03_calculate_temporal_window_mean")
+identify_seasons = importlib.import_module("04_identify_dry_wet_seasons")
+extract_seasons = importlib.import_module("05_extract_dry_wet_seasons")
+scale_precip = importlib.import_module("06_scale_precipitation")
+create_experiment = importlib.import_module("07_create_experiment")
+
+SAVE = False
+
+
+def main(
+    start=select_data.START,
+    end=select_data.END,
+    threshold=identify_seasons.PRECIP_THRESHOLD,
+    target_year=scale_precip.TARGET_YEAR,
+    per_cell=config.PER_CELL_SEASONS,
+    land_only=config.LAND_ONLY,
+    exp_start=config.EXP_START,
+    exp_end=config.EXP_END,
+    experiment_name=create_experiment.EXPERIMENT_NAME,
+    force=False,
+    output_format=create_experiment.OUTPUT_FORMAT,
+    save=SAVE,
+):
+    # %% Select data
+
+    variables, dates, lats, lons = ncutils.load_variables(
+        select_data.VARIABLES, start=start, end=end
+    )
+    selected = select_data.run(variables, dates, start=start, end=end)
+    del variables, dates
+
+    if save:
+        select_data.save(selected, lats, lons, start=start, end=end)
+
+    precip = selected["precip"]
+    time = selected["time_precip"]
+
+    # %% Average over windows
+
+    means = window_mean.run(
+        precip, time, per_cell=per_cell, land_only=land_only
+    )
+    if save:
+        window_mean.save(means)
+
+    # %% Identify dry and wet seasons
+
+    dry_seasons, _ = identify_seasons.run(
+        means["precip"],
+        means["window_mid"],
+        means.get("precip_cells"),
+        threshold=threshold,
+        per_cell=per_cell,
+    )
+    if save:
+        identify_seasons.save(dry_seasons, threshold=threshold)
+
+    # %% Extract dry and wet seasons
+
+    cells = {}
+    if per_cell:
+        for name in ["dry_start_cells", "dry_end_cells"]:
+            cells[name] = extract_seasons.select_threshold(
+                dry_seasons[name], dry_seasons["thresholds"], threshold
+            )
+
+    climatology = extract_seasons.run(
+        precip,
+        time,
+        dry_seasons["dry_start"],
+        dry_seasons["dry_end"],
+        land_only=land_only,
+        **cells,
+    )
+    if save:
+        extract_seasons.save(climatology, land_only=land_only)
+
+    # %% Scale precipitation
+
+    window, _, _ = scale_precip.target_window(
+        climatology["time_wet"], target_year, per_cell
+    )
+    window["assume_sorted"] = utils.is_sorted(time)
+    precip_target = utils.select_time(precip, time, **window)
+    time_target = utils.select_time(time, time, **window)
+    target_start = scale_precip.target_start_index(
+        time, time_target, target_year
+    )
+
+    if per_cell:
+        name = "precip_wet_total_cells"
+        cells[name] = climatology[name]
+
+    precip_target_scaled, _ = scale_precip.run(
+        precip_target,
+        time_target,
+        climatology["precip_wet_total"],
+        target_year=target_year,
+        land_only=land_only,
+        **cells,
+    )
+    if save:
+        scale_precip.save(
+            precip_target_scaled, target_start, target_year=target_year
+        )
+
+    # %% Create experiment
+
+    # The selected precipitation is not used anymore, so the scaled window
+    # is written into it instead of a copy
+    target_end = target_start + len(precip_target_scaled)
+    precip[target_start:target_end] = precip_target_scaled
+
+    variables = {}
+    times = {}
+    for variable in create_experiment.OUTPUT_VARIABLES:
+        variables[variable] = selected[variable]
+        times[variable] = selected[f"time_{variable}"]
+
+    create_experiment.run(
+        variables,
+        times,
+        lats,
+        lons,
+        start=exp_start,
+        end=exp_end,
+        experiment_name=experiment_name,
+        force=force,
+        output_format=output_format,
+        land_only=land_only,
+    )
+
+
+if __name__ == "__main__":
+    main()
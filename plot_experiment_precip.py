@@ -1,9 +1,23 @@
+#!/usr/bin/env python
+"""Plot observed and scaled precipitation of the experiment.
+
+The figures are rendered from the cached diagnostics (see ``diagnostics.py``)
+instead of the full precipitation archives. With ``--batch``, all figures are
+rendered in parallel without showing them.
+"""
+
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 
+import diagnostics
+import utils
+
 INPUT_DIR = Path("output/select_data")
 INPUT_DIR_SCALED = Path("output/scale_precipitation")
 
@@ -12,35 +26,126 @@ FIG_DIR = Path("fig")
 START = datetime(2023, 1, 1)
 END = datetime(2025, 4, 1)
 
-time = np.load(INPUT_DIR / "time_precip.npy", allow_pickle=True)
-precip = np.load(INPUT_DIR / "precip.npy")
-precip_scaled = np.load(INPUT_DIR_SCALED / "precip.npy")
 
+def load_diagnostics():
+    """Load diagnostics of observed and scaled precipitation."""
+    observed = diagnostics.load(INPUT_DIR, "precip")
+    scaled = diagnostics.load(INPUT_DIR_SCALED, "precip", lats_dir=INPUT_DIR)
+    return observed, scaled
+
+
+def select(results, key):
+    """Select time and ``key`` from ``results`` between START and END."""
+    time = results["time"]
+    options = dict(
+        start=START,
+        end=END,
+        include_endpoint=True,
+        assume_sorted=utils.is_sorted(time),
+    )
+    return (
+        utils.select_time(time, time, **options),
+        utils.select_time(results[key], time, **options),
+    )
+
+
+def plot_precip_diff():
+    observed, scaled = load_diagnostics()
+    time, precip_mean = select(observed, "domain_mean")
+    _, precip_scaled_mean = select(scaled, "domain_mean")
+
+    fig = plt.figure(figsize=(8, 6))
+    ax = fig.add_subplot(2, 1, 1)
+
+    ax.plot(time, precip_mean, label="Observed")
+    ax.plot(time, precip_scaled_mean, label="Scaled")
+
+    ax.set_ylabel("Precipitation (mm/3hr)")
+    ax.legend()
+
+    ax = fig.add_subplot(2, 1, 2)
+    ax.plot(time, precip_scaled_mean - precip_mean)
+
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Precipitation diff (mm/3hr)")
+
+    fig.savefig(FIG_DIR / "precip_diff.png")
+    return fig
+
+
+def plot_precip_la():
+    observed, scaled = load_diagnostics()
+    time, precip_la = select(observed, "point")
+    _, precip_scaled_la = select(scaled, "point")
+
+    fig = plt.figure(figsize=(8, 4))
+    ax = fig.add_subplot(111)
+
+    ax.plot(time, np.cumsum(precip_la), label="Observed")
+    ax.plot(time, np.cumsum(precip_scaled_la), label="Scaled")
+
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Cumulative precipitation in LA (mm)")
+    ax.legend()
+
+    fig.savefig(FIG_DIR / "precip_la.png")
+    return fig
+
+
+def plot_monthly_precip():
+    observed, scaled = load_diagnostics()
+    months = np.arange(1, 12 + 1)
+    width = 0.4
+
+    fig = plt.figure(figsize=(8, 4))
+    ax = fig.add_subplot(111)
+
+    ax.bar(
+        months - width / 2,
+        observed["monthly_domain_mean"],
+        width,
+        label="Observed",
+    )
+    ax.bar(
+        months + width / 2,
+        scaled["monthly_domain_mean"],
+        width,
+        label="Scaled",
+    )
+
+    ax.set_xticks(months)
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Precipitation (mm/3hr)")
+    ax.legend()
+
+    fig.savefig(FIG_DIR / "precip_monthly.png")
+    return fig
+
+
+FIGURES = [plot_precip_diff, plot_precip_la, plot_monthly_precip]
 
-sel = (START <= time) & (time <= END)
-time = time[sel]
-precip = precip[sel]
-precip_scaled = precip_scaled[sel]
 
-precip_mean = precip.mean(axis=(1, 2))
-precip_scaled_mean = precip_scaled.mean(axis=(1, 2))
+def _render(plot_function):
+    matplotlib.use("Agg")
+    fig = plot_function()
+    plt.close(fig)
 
-fig = plt.figure(figsize=(8, 6))
-ax = fig.add_subplot(2, 1, 1)
 
-ax.plot(time, precip_mean, label="Observed")
-ax.plot(time, precip_scaled_mean, label="Scaled")
+def main(batch=False):
+    FIG_DIR.mkdir(exist_ok=True, parents=True)
 
-ax.set_ylabel("Precipitation (mm/3hr)")
-ax.legend()
+    if batch:
+        # Make sure the cache is up to date before the workers read it
+        load_diagnostics()
+        with ProcessPoolExecutor() as executor:
+            list(executor.map(_render, FIGURES))
+        return
 
-ax = fig.add_subplot(2, 1, 2)
-ax.plot(time, precip_scaled_mean - precip_mean)
+    for plot_function in FIGURES:
+        plot_function()
 
-ax.set_xlabel("Date")
-ax.set_ylabel("Precipitation diff (mm/3hr)")
+    plt.show()
 
-FIG_DIR.mkdir(exist_ok=True, parents=True)
-fig.savefig(FIG_DIR / "precip_diff.png")
 
-plt.show()
+if __name__ == "__main__":
+    main(batch="--batch" in sys.argv[1:])
@@ -0,0 +1,176 @@
+"""Utils for dry and wet seasons.
+
+For seasons identified per grid cell, the boundaries are represented as
+offsets in seconds since the start of the year, computed as if the year had
+no leap day, so that the same boundary maps can be applied to every year.
+
+The grid cell dimensions (lat, lon) can also be the single dimension (n_land)
+of land cells packed with :func:`utils.pack_land`.
+"""
+
+import warnings
+
+import numpy as np
+
+from sparse import SparseSeries
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def time_of_year(time):
+    """Seconds since the start of the year for ``time``, ignoring leap days.
+
+    In leap years, times from Feb 29 onwards are shifted back by one day so
+    that the same month and day give the same offset in all years.
+
+    """
+    time = np.asarray(time).astype("datetime64[s]")
+    start_of_year = time.astype("datetime64[Y]")
+    offset = (time - start_of_year).astype(np.int64)
+
+    years = start_of_year.astype(int) + 1970
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+    feb_29 = start_of_year + np.timedelta64(31 + 28, "D")
+    offset[leap & (time >= feb_29)] -= SECONDS_PER_DAY
+
+    return offset
+
+
+def year_of(time):
+    """Calendar year of ``time``."""
+    time = np.asarray(time).astype("datetime64[s]")
+    return time.astype("datetime64[Y]").astype(int) + 1970
+
+
+def identify_dry_season_cells(window_mean, thresholds):
+    """Identify the dry season for each grid cell and threshold.
+
+    ``window_mean`` has dimensions (year, window, lat, lon). A window is dry
+    if the median over the years is below the threshold. Returns index maps
+    with dimensions (threshold, lat, lon) of the first and last dry window,
+    set to -1 for cells without any dry window.
+
+    """
+    with warnings.catch_warnings():
+        # Ocean cells are NaN for all years
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(window_mean, axis=0)
+
+    thresholds = np.atleast_1d(thresholds)
+    thresholds = thresholds.reshape((-1,) + (1,) * median.ndim)
+    dry = median[np.newaxis] < thresholds
+    has_dry = dry.any(axis=1)
+
+    nwindows = dry.shape[1]
+    start_index = np.argmax(dry, axis=1)
+    end_index = nwindows - 1 - np.argmax(dry[:, ::-1], axis=1)
+
+    start_index[~has_dry] = -1
+    end_index[~has_dry] = -1
+
+    return start_index, end_index
+
+
+def index_to_offset(index, window_bounds):
+    """Convert window index maps to season boundary offsets.
+
+    ``window_bounds`` are the boundary dates of each window for one year.
+    Returns offsets in seconds since the start of the year, NaN where
+    ``index`` is -1.
+
+    """
+    offsets = time_of_year(window_bounds).astype(float)
+    res = offsets[index]
+    res[index < 0] = np.nan
+    return res
+
+
+def season_mask(time, year, dry_start, dry_end, wet_or_dry):
+    """Mask of time steps in the season starting in ``year`` per grid cell.
+
+    ``dry_start`` and ``dry_end`` are boundary offset maps (lat, lon) from
+    :func:`index_to_offset`. The wet season runs from the end of the dry
+    season in ``year`` to the start of the dry season in the next year.
+    Returns a boolean array with dimensions (time, lat, lon).
+
+    """
+    shape = (-1,) + (1,) * np.ndim(dry_start)
+    offset = time_of_year(time).reshape(shape)
+    years = year_of(time).reshape(shape)
+
+    if wet_or_dry == "dry":
+        mask = (years == year) & (dry_start <= offset) & (offset < dry_end)
+    else:
+        mask = ((years == year) & (offset >= dry_end)) | (
+            (years == year + 1) & (offset < dry_start)
+        )
+
+    return mask
+
+
+class SeasonAccumulator:
+    """Running climatology of a season, added one year at a time.
+
+    Keeps the running sum of the seasonal total and, if ``climatology`` is
+    True, the running sum for each time step of the season. This way, the
+    seasons of all years never have to be held in memory at once. The running
+    sums are dense also for sparse seasons, so that the climatology takes the
+    memory of one dense season regardless of the number of wet time steps.
+
+    """
+
+    def __init__(self, climatology=True):
+        self.climatology = climatology
+        self.count = 0
+        self.total_sum = None
+        self.timestep_sum = None
+
+    def add(self, data, mask=None):
+        """Add the season ``data`` (time, lat, lon) of one year.
+
+        If ``mask`` is given, only values where it is True are included, for
+        example to use the seasons of each grid cell from :func:`season_mask`.
+
+        ``data`` can also be a :class:`sparse.SparseSeries`, in which case
+        only its wet time steps are added (unless ``mask`` is given).
+
+        """
+        if isinstance(data, SparseSeries):
+            if mask is None:
+                self._add_sparse(data)
+                return
+            data = data.dense()
+
+        if mask is not None:
+            data = np.where(mask, data, 0)
+
+        if self.count == 0:
+            self.total_sum = np.zeros(data.shape[1:])
+            if self.climatology:
+                self.timestep_sum = np.zeros(data.shape)
+
+        self.total_sum += data.sum(axis=0)
+        if self.climatology:
+            # All seasons must have the same length since leap days are
+            # removed
+            self.timestep_sum += data
+        self.count += 1
+
+    def _add_sparse(self, data):
+        if self.count == 0:
+            self.total_sum = np.zeros(data.shape[1:])
+            if self.climatology:
+                self.timestep_sum = np.zeros(data.shape)
+
+        self.total_sum += data.sum()
+        if self.climatology:
+            self.timestep_sum[data.index] += data.values
+        self.count += 1
+
+    def total(self):
+        """Mean seasonal total."""
+        return self.total_sum / self.count
+
+    def mean(self):
+        """Mean for each time step of the season."""
+        return self.timestep_sum / self.count
@@ -0,0 +1,92 @@
+"""Sparse representation of precipitation along the time axis.
+
+Only the time steps where any grid cell is non-zero (wet time steps) are kept,
+together with their indices, so that memory and disk usage scale with the
+number of wet time steps instead of the length of the record. Sums and means
+over time are computed from the wet time steps only.
+
+Slicing along time returns a view, so that a :class:`SparseSeries` can be
+passed to ``utils.select_time`` with a sorted time axis.
+"""
+
+import numpy as np
+
+
+def wet_steps(array):
+    """Indices of the time steps of ``array`` with any non-zero value."""
+    array = np.asarray(array)
+    wet = array.reshape(array.shape[0], -1) != 0
+    return np.flatnonzero(wet.any(axis=1))
+
+
+class SparseSeries:
+    """Array with dimensions (time, ...) stored as its wet time steps.
+
+    ``index`` are the (sorted) indices of the wet time steps and ``values``
+    the values at these time steps. All other time steps are zero.
+
+    """
+
+    def __init__(self, index, values, shape):
+        self.index = np.asarray(index, dtype=np.int64)
+        self.values = np.asarray(values)
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, array):
+        array = np.asarray(array)
+        index = wet_steps(array)
+        return cls(index, array[index], array.shape)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        # Only slices, as used by ``utils.select_time`` for sorted time
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("SparseSeries only supports slicing along time")
+        return self.select(key.start, key.stop)
+
+    def select(self, start, stop):
+        """Time steps from ``start`` to ``stop`` (exclusive) as a view."""
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        i0, i1 = np.searchsorted(self.index, [start, stop])
+        return SparseSeries(
+            self.index[i0:i1] - start,
+            self.values[i0:i1],
+            (stop - start,) + self.shape[1:],
+        )
+
+    def dense(self, start=None, stop=None):
+        """Dense array of the time steps from ``start`` to ``stop``."""
+        series = self.select(start, stop)
+        array = np.zeros(series.shape, dtype=self.dtype)
+        array[series.index] = series.values
+        return array
+
+    def sum(self):
+        """Sum over time."""
+        return self.values.sum(axis=0)
+
+    def mean(self):
+        """Mean over time."""
+        return self.sum() / len(self)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Concatenate ``parts`` along time."""
+        offsets = np.cumsum([0] + [len(part) for part in parts[:-1]])
+        index = np.concatenate(
+            [
+                part.index + offset
+                for part, offset in zip(parts, offsets, strict=True)
+            ]
+        )
+        values = np.concatenate([part.values for part in parts])
+        shape = (sum(len(part) for part in parts),) + parts[0].shape[1:]
+        return cls(index, values, shape)
@@ -0,0 +1,476 @@
+"""Consolidated on-disk store for intermediate results.
+
+Each stage writes its outputs to one directory with a ``store.json`` file
+describing all arrays (shape, dtype, chunks and time coverage) together with
+attributes such as the parameters and input fingerprints of the stage.
+
+Arrays are split into chunks along the first axis and saved as ``.npy``
+files, so that a date range can be read without loading the whole array.
+Arrays of datetime objects are saved as ``datetime64[s]`` and converted back
+to datetime objects when loaded. Whether they are sorted is recorded, so that
+date ranges can be selected by binary search without checking the order.
+
+An array can also be linked from the store of another stage and modified in a
+time window, in which case only the modified chunks are written. Linked chunks
+are hard links, so they are not affected when the other store is rewritten.
+
+Arrays that are zero at most time steps, such as precipitation, can be saved
+sparse: each chunk is then saved as an ``.npz`` file with only the wet time
+steps (see :mod:`sparse`). They are converted back to dense arrays when loaded
+with :func:`load`, or can be loaded in sparse form with :func:`load_sparse`.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import utils
+from sparse import SparseSeries
+
+METADATA_FILE = "store.json"
+CHUNK_SIZE = 365 * 8  # one year of 3-hourly data (without leap days)
+TIME_DTYPE = "datetime64[s]"
+
+
+def fingerprint(*paths):
+    """Fingerprint of ``paths`` based on path, size and modification time.
+
+    For a store directory, the fingerprint of its metadata file is used, which
+    changes every time the store is written to.
+
+    """
+    sha = hashlib.sha1()
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            path = path / METADATA_FILE
+        stat = path.stat()
+        key = f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns};"
+        sha.update(key.encode())
+    return sha.hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, Path):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+
+def read_metadata(stage_dir):
+    """Read metadata of the store in ``stage_dir``."""
+    path = Path(stage_dir) / METADATA_FILE
+    if not path.exists():
+        return {"attrs": {}, "arrays": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_metadata(stage_dir, metadata):
+    """Write ``metadata`` of the store in ``stage_dir``."""
+    path = Path(stage_dir) / METADATA_FILE
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(metadata, f, indent=2, default=_json_default)
+    os.replace(tmp_path, path)
+
+
+def set_attrs(stage_dir, **attrs):
+    """Set store attributes in ``stage_dir``."""
+    stage_dir = Path(stage_dir)
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    metadata = read_metadata(stage_dir)
+    metadata["attrs"].update(attrs)
+    write_metadata(stage_dir, metadata)
+
+
+def get_attrs(stage_dir, name=None):
+    """Get store attributes in ``stage_dir`` (or of array ``name``)."""
+    metadata = read_metadata(stage_dir)
+    if name is None:
+        return metadata["attrs"]
+    return metadata["arrays"][name]["attrs"]
+
+
+def _is_datetime(array):
+    return array.dtype == object and isinstance(
+        array.flat[0] if array.size else None, datetime
+    )
+
+
+def _chunk_bounds(size, chunk_size):
+    return [
+        (start, min(start + chunk_size, size))
+        for start in range(0, max(size, 1), chunk_size)
+    ]
+
+
+def _save_chunk(path, array):
+    np.save(path, array)
+
+
+def _save_sparse_chunk(path, array):
+    series = SparseSeries.from_dense(array)
+    np.savez(path, index=series.index, values=series.values)
+
+
+def _load_sparse_chunk(path, entry, chunk):
+    with np.load(path) as f:
+        shape = [chunk["stop"] - chunk["start"]] + entry["shape"][1:]
+        return SparseSeries(f["index"], f["values"], shape)
+
+
+def _link_file(src, dst):
+    """Hard link ``src`` to ``dst``, or copy if hard links are not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _unshare_file(path):
+    """Replace ``path`` by a copy if it is hard linked from another store."""
+    if path.stat().st_nlink > 1:
+        tmp_path = path.with_name(path.name + ".tmp")
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+def _chunk_file(name, i, sparse=False):
+    suffix = ".npz" if sparse else ".npy"
+    return f"{name}/{i:05d}{suffix}"
+
+
+def _write_chunks(
+    stage_dir, name, array, bounds, max_workers=None, sparse=False
+):
+    chunk_dir = Path(stage_dir) / name
+    if chunk_dir.exists():
+        shutil.rmtree(chunk_dir)
+    chunk_dir.mkdir(parents=True)
+
+    files = [_chunk_file(name, i, sparse) for i in range(len(bounds))]
+    save_chunk = _save_sparse_chunk if sparse else _save_chunk
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(save_chunk, Path(stage_dir) / f, array[b0:b1])
+            for f, (b0, b1) in zip(files, bounds, strict=True)
+        ]
+        for future in futures:
+            future.result()
+
+    return files
+
+
+def save(
+    stage_dir,
+    name,
+    array,
+    time=None,
+    attrs=None,
+    chunk_size=CHUNK_SIZE,
+    max_workers=None,
+    sparse=False,
+):
+    """Save ``array`` as ``name`` in the store in ``stage_dir``.
+
+    If ``time`` is given, it is saved as ``time_<name>`` with the same chunks
+    as ``array``, and ``name`` can then be read by date range with
+    :func:`load`. Chunks are written in parallel. If ``sparse`` is True,
+    only the wet time steps of ``array`` are saved.
+
+    """
+    stage_dir = Path(stage_dir)
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    metadata = read_metadata(stage_dir)
+
+    arrays = {name: np.asarray(array)}
+    if time is not None:
+        arrays[f"time_{name}"] = np.asarray(time)
+
+    for array_name, values in arrays.items():
+        is_datetime = _is_datetime(values)
+        if is_datetime:
+            values = values.astype(TIME_DTYPE)
+
+        is_sparse = sparse and array_name == name and values.ndim > 0
+        entry = {
+            "shape": list(values.shape),
+            "dtype": str(values.dtype),
+            "datetime": is_datetime,
+            "sparse": is_sparse,
+            "sorted": (
+                utils.is_sorted(values)
+                if is_datetime and values.ndim == 1
+                else None
+            ),
+            "time": None,
+            "attrs": {},
+        }
+
+        if values.ndim == 0:
+            bounds = [(None, None)]
+            np.save(stage_dir / f"{array_name}.npy", values)
+            files = [f"{array_name}.npy"]
+        else:
+            bounds = _chunk_bounds(values.shape[0], chunk_size)
+            files = _write_chunks(
+                stage_dir, array_name, values, bounds, max_workers, is_sparse
+            )
+
+        entry["chunks"] = [
+            {"file": f, "start": b0, "stop": b1}
+            for f, (b0, b1) in zip(files, bounds, strict=True)
+        ]
+        metadata["arrays"][array_name] = entry
+
+    if time is not None:
+        time_name = f"time_{name}"
+        time_entry = metadata["arrays"][time_name]
+        time_values = np.asarray(time).astype(TIME_DTYPE)
+        for chunk in time_entry["chunks"]:
+            if chunk["stop"] == chunk["start"]:
+                continue
+            chunk["time_start"] = str(time_values[chunk["start"]])
+            chunk["time_end"] = str(time_values[chunk["stop"] - 1])
+        time_entry["time"] = time_name
+        metadata["arrays"][name]["time"] = time_name
+
+    if attrs is not None:
+        metadata["arrays"][name]["attrs"] = attrs
+
+    write_metadata(stage_dir, metadata)
+
+
+def _load_chunks(stage_dir, entry, chunks, mmap_mode=None):
+    if entry.get("sparse", False):
+        parts = [
+            _load_sparse_chunk(Path(stage_dir) / chunk["file"], entry, chunk)
+            for chunk in chunks
+        ]
+        parts = [part.dense() for part in parts]
+    else:
+        parts = [
+            np.load(Path(stage_dir) / chunk["file"], mmap_mode=mmap_mode)
+            for chunk in chunks
+        ]
+    if len(parts) == 1:
+        return parts[0]
+    if not parts:
+        shape = [0] + entry["shape"][1:]
+        return np.zeros(shape, dtype=entry["dtype"])
+    return np.concatenate(parts)
+
+
+def _decode(entry, values):
+    if entry["datetime"]:
+        return values.astype(object)
+    return values
+
+
+def load(
+    stage_dir,
+    name,
+    start=None,
+    end=None,
+    include_endpoint=False,
+    mmap_mode=None,
+):
+    """Load array ``name`` from the store in ``stage_dir``.
+
+    If ``start`` or ``end`` is given, only chunks overlapping the date range
+    are read and the time steps between ``start`` and ``end`` are returned.
+
+    """
+    metadata = read_metadata(stage_dir)
+    entry = metadata["arrays"][name]
+
+    if start is None and end is None:
+        values = _load_chunks(stage_dir, entry, entry["chunks"], mmap_mode)
+        return _decode(entry, values)
+
+    start = np.datetime64(start or "0001-01-01", "s")
+    end = np.datetime64(end or "9999-12-31", "s")
+    chunks, time = _load_time_chunks(stage_dir, metadata, name, start, end)
+
+    values = _load_chunks(stage_dir, entry, chunks, mmap_mode)
+    values = utils.select_time(
+        values,
+        time,
+        start,
+        end,
+        include_endpoint=include_endpoint,
+        assume_sorted=is_sorted(stage_dir, entry["time"], metadata),
+    )
+
+    return _decode(entry, values)
+
+
+def _load_time_chunks(stage_dir, metadata, name, start, end):
+    """Chunks of ``name`` overlapping ``start`` to ``end`` and their time."""
+    entry = metadata["arrays"][name]
+    if entry["time"] is None:
+        raise ValueError(f"{name} has no time axis")
+    time_entry = metadata["arrays"][entry["time"]]
+
+    indices = [
+        i
+        for i, chunk in enumerate(time_entry["chunks"])
+        if "time_start" in chunk
+        and np.datetime64(chunk["time_start"]) <= end
+        and np.datetime64(chunk["time_end"]) >= start
+    ]
+    time_chunks = [time_entry["chunks"][i] for i in indices]
+    chunks = [entry["chunks"][i] for i in indices]
+
+    return chunks, _load_chunks(stage_dir, time_entry, time_chunks)
+
+
+def is_sorted(stage_dir, name, metadata=None):
+    """Check if time axis ``name`` is sorted, None if not recorded."""
+    if metadata is None:
+        metadata = read_metadata(stage_dir)
+    return metadata["arrays"][name].get("sorted")
+
+
+def is_sparse(stage_dir, name):
+    """Check if array ``name`` is saved sparse."""
+    entry = read_metadata(stage_dir)["arrays"][name]
+    return entry.get("sparse", False)
+
+
+def load_sparse(stage_dir, name, start=None, end=None, include_endpoint=False):
+    """Load sparse array ``name`` as a :class:`sparse.SparseSeries`.
+
+    Only the wet time steps are read. ``start`` and ``end`` are used as in
+    :func:`load`.
+
+    """
+    metadata = read_metadata(stage_dir)
+    entry = metadata["arrays"][name]
+    if not entry.get("sparse", False):
+        raise ValueError(f"{name} is not sparse")
+
+    if start is None and end is None:
+        chunks = entry["chunks"]
+    else:
+        start = np.datetime64(start or "0001-01-01", "s")
+        end = np.datetime64(end or "9999-12-31", "s")
+        chunks, time = _load_time_chunks(stage_dir, metadata, name, start, end)
+
+    parts = [
+        _load_sparse_chunk(Path(stage_dir) / chunk["file"], entry, chunk)
+        for chunk in chunks
+    ]
+    if not parts:
+        shape = [0] + entry["shape"][1:]
+        return SparseSeries([], np.zeros(shape, dtype=entry["dtype"]), shape)
+    series = SparseSeries.concatenate(parts)
+
+    if start is None and end is None:
+        return series
+
+    steps = utils.select_time(
+        np.arange(len(series)),
+        time,
+        start,
+        end,
+        include_endpoint=include_endpoint,
+        assume_sorted=is_sorted(stage_dir, entry["time"], metadata),
+    )
+    if steps.size == 0:
+        return series.select(0, 0)
+    return series.select(steps[0], steps[-1] + 1)
+
+
+def link(src_dir, stage_dir, name):
+    """Add array ``name`` from the store in ``src_dir`` without copying it.
+
+    The chunk files of the array (and its time axis, if any) are hard linked
+    to the store in ``stage_dir``, so that they keep their contents when the
+    store in ``src_dir`` is rewritten. Use :func:`write_window` to modify
+    the array; only the modified chunks are then copied.
+
+    """
+    src_dir = Path(src_dir)
+    stage_dir = Path(stage_dir)
+    stage_dir.mkdir(parents=True, exist_ok=True)
+
+    src_metadata = read_metadata(src_dir)
+    metadata = read_metadata(stage_dir)
+
+    names = [name]
+    time_name = src_metadata["arrays"][name]["time"]
+    if time_name is not None and time_name != name:
+        names.append(time_name)
+
+    for array_name in names:
+        entry = json.loads(json.dumps(src_metadata["arrays"][array_name]))
+
+        # Remove chunks from previous writes
+        chunk_dir = stage_dir / array_name
+        if chunk_dir.exists():
+            shutil.rmtree(chunk_dir)
+        chunk_dir.mkdir()
+
+        for i, chunk in enumerate(entry["chunks"]):
+            local_file = _chunk_file(array_name, i, entry.get("sparse", False))
+            _link_file(src_dir / chunk["file"], stage_dir / local_file)
+            chunk["file"] = local_file
+        metadata["arrays"][array_name] = entry
+
+    write_metadata(stage_dir, metadata)
+
+
+def write_window(stage_dir, name, values, start):
+    """Overwrite array ``name`` with ``values`` from index ``start``.
+
+    Only chunks overlapping the window are modified, in place through a
+    memory map. Chunks linked from another store (see :func:`link`) are
+    copied before they are modified. Sparse chunks are rewritten instead.
+
+    """
+    stage_dir = Path(stage_dir)
+    metadata = read_metadata(stage_dir)
+    entry = metadata["arrays"][name]
+    stop = start + len(values)
+
+    for i, chunk in enumerate(entry["chunks"]):
+        overlap_start = max(start, chunk["start"])
+        overlap_stop = min(stop, chunk["stop"])
+        if overlap_start >= overlap_stop:
+            continue
+
+        path = stage_dir / chunk["file"]
+        sparse = entry.get("sparse", False)
+        chunk_start = overlap_start - chunk["start"]
+        chunk_stop = overlap_stop - chunk["start"]
+        window = values[overlap_start - start : overlap_stop - start]
+
+        if sparse:
+            # Sparse chunks are rewritten as a new file
+            array = _load_sparse_chunk(path, entry, chunk).dense()
+            array[chunk_start:chunk_stop] = window
+            path.unlink()
+            _save_sparse_chunk(path, array)
+            continue
+
+        _unshare_file(path)
+        array = np.load(path, mmap_mode="r+")
+        array[chunk_start:chunk_stop] = window
+        array.flush()
+        del array
+
+    write_metadata(stage_dir, metadata)
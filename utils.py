@@ -4,31 +4,89 @@ import netCDF4 as nc
 import numpy as np
 
 from config import OCEAN_THRESHOLD
+from sparse import SparseSeries
 
 
-def mask_ocean_values(array):
-    """Set values over the ocean to np.array in ``array``."""
+def land_mask():
+    """Mask of land cells with dimensions (lat, lon)."""
     with nc.Dataset("data/IMERG_land_sea_mask.nc") as ncfile:
         sea_mask = ncfile.variables["landseamask"][:]
 
     sea_mask = sea_mask[::-1]
-    sea_mask[sea_mask <= OCEAN_THRESHOLD] = 0
-    sea_mask[sea_mask > OCEAN_THRESHOLD] = 1
-    sea_mask = sea_mask.astype(bool)
+    return np.asarray(sea_mask <= OCEAN_THRESHOLD)
+
 
+def mask_ocean_values(array):
+    """Set values over the ocean to np.array in ``array``."""
     array_masked = array.copy()
-    array_masked[..., sea_mask] = np.nan
+    array_masked[..., ~land_mask()] = np.nan
 
     return array_masked
 
 
+def pack_land(array, mask):
+    """Keep only land cells of ``array`` with dimensions (..., lat, lon).
+
+    Returns an array with dimensions (..., n_land), where the land cells are
+    in the order of ``np.flatnonzero(mask)``. ``array`` can also be a
+    :class:`sparse.SparseSeries`.
+
+    """
+    if isinstance(array, SparseSeries):
+        shape = (len(array), np.count_nonzero(mask))
+        return SparseSeries(array.index, array.values[..., mask], shape)
+    return array[..., mask]
+
+
+def unpack_land(packed, mask, fill_value=np.nan):
+    """Inverse of :func:`pack_land`.
+
+    Ocean cells are set to ``fill_value``, which can also be an array with
+    the full dimensions (..., lat, lon).
+
+    """
+    array = np.empty(
+        packed.shape[:-1] + mask.shape,
+        dtype=np.result_type(packed, fill_value),
+    )
+    array[...] = fill_value
+    array[..., mask] = packed
+
+    return array
+
+
 def repeat(array, size):
     """Repeat `array` (for example climatology) to fit length `size`."""
     return np.tile(array, 99)[:size]
 
 
-def select_time(array, time, start, end, include_endpoint=False):
-    """Select slice in ``array`` between ``start`` and ``end``."""
+def is_sorted(time):
+    """Check if ``time`` is sorted in ascending order."""
+    return bool(np.all(time[1:] >= time[:-1]))
+
+
+def select_time(
+    array, time, start, end, include_endpoint=False, assume_sorted=None
+):
+    """Select slice in ``array`` between ``start`` and ``end``.
+
+    If ``time`` is sorted, ``start`` and ``end`` are located by binary search
+    and a view of ``array`` is returned. Otherwise, a boolean mask is used and
+    the selection is a copy. If ``assume_sorted`` is None, ``time`` is checked
+    on every call, which is linear in its length; pass the result of
+    :func:`is_sorted` (or ``store.is_sorted`` for time axes from a store) when
+    selecting from the same ``time`` repeatedly.
+
+    """
+    if assume_sorted is None:
+        assume_sorted = is_sorted(time)
+
+    if assume_sorted:
+        end_side = "right" if include_endpoint else "left"
+        i_start = np.searchsorted(time, start, side="left")
+        i_end = np.searchsorted(time, end, side=end_side)
+        return array[i_start:i_end]
+
     if not include_endpoint:
         sel = (time >= start) & (time < end)
     else:
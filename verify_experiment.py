@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""Verify BEPS files of an experiment against the 3-hourly input.
+
+For each daily file, check that:
+- hourly precipitation summed over each 3-hour bin within the day matches the
+  3-hourly input,
+- the other variables at the 3-hourly time steps match the input with the
+  unit conversions applied exactly once.
+
+Files are read in batches by parallel worker processes and compared in
+vectorized form. The maximum error of each check for each day is saved to
+``LOG_DIR``, with NaN for days without input or where the file lacks the
+variable. Files lacking a variable fail the verification.
+"""
+
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import netCDF4 as nc
+import numpy as np
+
+import ioutils
+import store
+
+INPUT_DIR = Path("output/select_data")
+INPUT_DIR_SCALED = Path("output/scale_precipitation")
+
+EXPERIMENT_DIR = Path("output/create_experiment/scaled_to_climatology")
+LOG_DIR = Path("log")
+
+BATCH_SIZE = 64
+TOLERANCE = 1e-3
+
+STEPS_PER_DAY = 8
+HOURS_PER_STEP = 3
+
+
+def read_batch(files):
+    """Read BEPS ``files`` into arrays with dimensions (file, hour, lat, lon).
+
+    Each array only contains the files with the variable, which are given by
+    the returned masks over ``files``.
+
+    """
+    data = {name: [] for name in ioutils.OUTPUT_VARIABLES}
+    present = {
+        name: np.zeros(len(files), dtype=bool)
+        for name in ioutils.OUTPUT_VARIABLES
+    }
+
+    for i, f in enumerate(files):
+        with nc.Dataset(f) as ncfile:
+            ncfile.set_auto_mask(False)
+            for name, values in data.items():
+                if name in ncfile.variables:
+                    values.append(ncfile.variables[name][:])
+                    present[name][i] = True
+
+    data = {name: np.stack(values) for name, values in data.items() if values}
+    return data, present
+
+
+def load_sources(start, end):
+    """Load 3-hourly input for the experiment between ``start`` and ``end``.
+
+    Returns values with BEPS units and time axes (as datetime64).
+
+    """
+    options = dict(start=start, end=end, include_endpoint=True)
+
+    variables = {}
+    times = {}
+    for variable in ioutils.OUTPUT_VARIABLES.values():
+        input_dir = INPUT_DIR_SCALED if variable == "precip" else INPUT_DIR
+        variables[variable] = store.load(input_dir, variable, **options)
+        time = store.load(input_dir, f"time_{variable}", **options)
+        times[variable] = time.astype(store.TIME_DTYPE)
+
+    return ioutils.convert_units(variables), times
+
+
+def source_steps(time, dates):
+    """Indices (day, step) of the 3-hourly input for each of ``dates``.
+
+    Returns the indices and a mask of days where all steps are available.
+
+    """
+    dates = np.array(dates, dtype=store.TIME_DTYPE)
+    steps = np.arange(STEPS_PER_DAY) * np.timedelta64(HOURS_PER_STEP, "h")
+
+    indices = np.searchsorted(time, dates)[:, None] + np.arange(STEPS_PER_DAY)
+    valid = np.all(indices < time.size, axis=1)
+    indices[~valid] = 0
+
+    expected = dates[:, None] + steps
+    valid &= np.all(time[indices] == expected, axis=1)
+
+    return indices, valid
+
+
+def compare(dates, data, present, sources, times):
+    """Maximum error of each check for each of ``dates``.
+
+    ``data`` and ``present`` are as returned by :func:`read_batch`. The error
+    is NaN for days without input or without the variable.
+
+    """
+    errors = {}
+
+    for name in ioutils.OUTPUT_VARIABLES:
+        error = np.full(len(dates), np.nan)
+        errors[name] = error
+        if name not in data:
+            continue
+
+        values = data[name]
+        rows = present[name]
+        variable = ioutils.OUTPUT_VARIABLES[name]
+        indices, valid = source_steps(times[variable], dates)
+        source = sources[variable][indices[rows]]
+
+        if variable == "precip":
+            # Bins (h - 3, h] for h = 3, 6, ..., 21 are within the day
+            nbins = STEPS_PER_DAY - 1
+            hourly = values[:, 1 : 1 + nbins * HOURS_PER_STEP]
+            bins = hourly.reshape(
+                (len(values), nbins, HOURS_PER_STEP) + values.shape[2:]
+            )
+            diff = bins.sum(axis=2) - source[:, 1:]
+        else:
+            diff = values[:, ::HOURS_PER_STEP] - source
+
+        error[rows] = np.nanmax(np.abs(diff), axis=(1, 2, 3))
+        error[~valid] = np.nan
+
+    return errors
+
+
+def parse_date(path):
+    return datetime.strptime(path.name, ioutils.FILENAME_FORMAT)
+
+
+def main(experiment_dir=EXPERIMENT_DIR):
+    experiment_dir = Path(experiment_dir)
+    files = sorted(experiment_dir.glob("beps_meteo_0.1_*.nc"))
+    if not files:
+        print(f"No files found in {experiment_dir}")
+        return False
+
+    dates = [parse_date(f) for f in files]
+    sources, times = load_sources(dates[0], dates[-1] + timedelta(days=1))
+
+    batches = [
+        files[i : i + BATCH_SIZE] for i in range(0, len(files), BATCH_SIZE)
+    ]
+
+    errors = {name: [] for name in ioutils.OUTPUT_VARIABLES}
+    present = {name: [] for name in ioutils.OUTPUT_VARIABLES}
+    with ProcessPoolExecutor() as executor:
+        for batch, (data, batch_present) in zip(
+            batches, executor.map(read_batch, batches), strict=True
+        ):
+            batch_dates = [parse_date(f) for f in batch]
+            batch_errors = compare(
+                batch_dates, data, batch_present, sources, times
+            )
+            for name, error in batch_errors.items():
+                errors[name].append(error)
+                present[name].append(batch_present[name])
+
+    errors = {name: np.concatenate(error) for name, error in errors.items()}
+    present = {name: np.concatenate(mask) for name, mask in present.items()}
+
+    # Save maximum errors per day
+    LOG_DIR.mkdir(exist_ok=True)
+    log_file = LOG_DIR / f"verify_{experiment_dir.name}.log"
+    with open(log_file, "w") as logfile:
+        logfile.write("date " + " ".join(errors.keys()) + "\n")
+        for i, date in enumerate(dates):
+            line = " ".join(f"{error[i]:.3g}" for error in errors.values())
+            logfile.write(f"{date:%Y-%m-%d} {line}\n")
+
+    ok = True
+    print(f":: Maximum error ({len(files)} files)")
+    for name, error in errors.items():
+        missing = np.isnan(error)
+        failed = error[~missing] > TOLERANCE
+        absent = ~present[name]
+        no_input = missing & ~absent
+
+        print(f"{name}: {np.nanmax(error, initial=0):.3g}")
+        if absent.any():
+            print(f"-> {absent.sum()} files without {name}")
+            ok = False
+        if no_input.any():
+            print(f"-> {no_input.sum()} days without input")
+        if failed.any():
+            print(f"-> {failed.sum()} days exceed tolerance {TOLERANCE}")
+            ok = False
+
+    print(f"Errors per day saved to {log_file}")
+
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        experiment_dir = sys.argv[1]
+    except IndexError:
+        experiment_dir = EXPERIMENT_DIR
+
+    if not main(experiment_dir):
+        sys.exit(1)
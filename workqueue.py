@@ -0,0 +1,214 @@
+"""Work queue on a shared filesystem for processes on one or more nodes.
+
+The work is split into blocks, and each block is claimed by creating a claim
+file with ``O_CREAT | O_EXCL`` in the queue directory, which fails if another
+process already claimed it. When a block is finished, a done marker is
+created and the claim file is removed, so that later runs skip it. Claims
+not refreshed for ``STALE_AFTER`` seconds (for example from a crashed
+process) can be taken over. While a block is processed, its claim is
+refreshed every ``HEARTBEAT`` seconds.
+
+Several processes can work through the same queue. With a shard ``i/n``, a
+process only considers the ``i``-th of ``n`` contiguous parts of the blocks
+(see :func:`select_shard`), for example one shard per node.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+HEARTBEAT = 60  # seconds
+STALE_AFTER = 10 * 60  # seconds
+
+
+def parse_shard(shard):
+    """Parse shard ``"i/n"`` to ``(i, n)``."""
+    index, count = (int(value) for value in str(shard).split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard: {shard}")
+    return index, count
+
+
+def select_shard(blocks, shard):
+    """Contiguous part ``shard`` of the dictionary ``blocks``."""
+    index, count = parse_shard(shard)
+    block_ids = list(blocks)
+    start = index * len(block_ids) // count
+    end = (index + 1) * len(block_ids) // count
+    return {block_id: blocks[block_id] for block_id in block_ids[start:end]}
+
+
+def _claim_file(queue_dir, block_id):
+    return Path(queue_dir) / f"{block_id}.claim"
+
+
+def _done_file(queue_dir, block_id):
+    return Path(queue_dir) / f"{block_id}.done"
+
+
+def is_done(queue_dir, block_id):
+    return _done_file(queue_dir, block_id).exists()
+
+
+def _read_claim(path):
+    """Token and modification time of claim file ``path``."""
+    with open(path) as f:
+        token = f.read().strip()
+    return token, os.stat(path).st_mtime
+
+
+def owns(queue_dir, block_id, token):
+    """Check if the claim of ``block_id`` is still ``token``."""
+    try:
+        current, _ = _read_claim(_claim_file(queue_dir, block_id))
+    except FileNotFoundError:
+        return False
+    return current == token
+
+
+def _take_over(claim_file, stale_after):
+    """Remove ``claim_file`` if it is stale, returns True if removed."""
+    try:
+        token, mtime = _read_claim(claim_file)
+    except FileNotFoundError:
+        return True
+    if time.time() - mtime < stale_after:
+        return False
+
+    # Only one process can rename the claim away, but it may have been
+    # replaced by a fresh claim in the meantime
+    stale_file = claim_file.with_name(f"{claim_file.name}.{uuid.uuid4().hex}")
+    try:
+        claim_file.rename(stale_file)
+    except FileNotFoundError:
+        return False
+
+    moved_token, moved_mtime = _read_claim(stale_file)
+    if moved_token != token or time.time() - moved_mtime < stale_after:
+        # Put the fresh claim back, unless yet another claim exists
+        try:
+            os.link(stale_file, claim_file)
+        except FileExistsError:
+            pass
+        stale_file.unlink()
+        return False
+
+    stale_file.unlink()
+    return True
+
+
+def claim(queue_dir, block_id, stale_after=STALE_AFTER):
+    """Try to claim ``block_id``.
+
+    Returns the token identifying the claim if successful, otherwise None.
+
+    """
+    claim_file = _claim_file(queue_dir, block_id)
+
+    if claim_file.exists() and not _take_over(claim_file, stale_after):
+        return None
+
+    try:
+        fd = os.open(claim_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+
+    token = f"{socket.gethostname()} {os.getpid()} {uuid.uuid4().hex}"
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{token}\n")
+
+    # Finished by another process between the checks
+    if is_done(queue_dir, block_id):
+        release(queue_dir, block_id, token)
+        return None
+
+    return token
+
+
+def refresh(queue_dir, block_id, token):
+    """Refresh the claim ``token`` of ``block_id``, returns False if lost."""
+    if not owns(queue_dir, block_id, token):
+        return False
+    os.utime(_claim_file(queue_dir, block_id))
+    return True
+
+
+def release(queue_dir, block_id, token):
+    """Release the claim ``token`` of ``block_id`` without marking it done."""
+    if owns(queue_dir, block_id, token):
+        _claim_file(queue_dir, block_id).unlink(missing_ok=True)
+
+
+def complete(queue_dir, block_id, token):
+    """Mark ``block_id`` as done, which must be claimed with ``token``."""
+    _done_file(queue_dir, block_id).touch()
+    release(queue_dir, block_id, token)
+
+
+def _heartbeat(queue_dir, block_id, token, stop, interval):
+    """Refresh the claim every ``interval`` seconds until ``stop`` is set."""
+    while not stop.wait(interval):
+        if not refresh(queue_dir, block_id, token):
+            return
+
+
+def run(
+    queue_dir,
+    blocks,
+    func,
+    stale_after=STALE_AFTER,
+    heartbeat=HEARTBEAT,
+):
+    """Call ``func(*block)`` for each unfinished block that can be claimed.
+
+    ``blocks`` is a dictionary of block arguments by block ID. The claim is
+    refreshed every ``heartbeat`` seconds while ``func`` runs. Returns the
+    IDs of the blocks processed by this process.
+
+    """
+    queue_dir = Path(queue_dir)
+    queue_dir.mkdir(parents=True, exist_ok=True)
+
+    processed = []
+    for block_id, block in blocks.items():
+        if is_done(queue_dir, block_id):
+            continue
+        token = claim(queue_dir, block_id, stale_after)
+        if token is None:
+            continue
+
+        stop = threading.Event()
+        refresher = threading.Thread(
+            target=_heartbeat,
+            args=(queue_dir, block_id, token, stop, heartbeat),
+            daemon=True,
+        )
+        refresher.start()
+        try:
+            func(*block)
+        except BaseException:
+            release(queue_dir, block_id, token)
+            raise
+        finally:
+            stop.set()
+            refresher.join()
+
+        # Another process took the block over, which marks it done instead
+        if not owns(queue_dir, block_id, token):
+            print(f"warning: Lost the claim of block {block_id}")
+            continue
+
+        complete(queue_dir, block_id, token)
+        processed.append(block_id)
+
+    return processed
+
+
+def pending(queue_dir, blocks):
+    """IDs of the blocks without done marker."""
+    return [
+        block_id for block_id in blocks if not is_done(queue_dir, block_id)
+    ]